@@ -0,0 +1,172 @@
+import argparse, os, csv, subprocess, tempfile, textwrap, time, tracemalloc, resource
+import numpy as np
+import pandas as pd
+from termcolor import colored
+import native_search
+import synthetic_assemblies
+from blast_mrsa_mlva import search_command
+from mlva_hits import read_hits
+from filter_mlva_blast import getmylogo, get_all_possible_sizes, get_number_repeats, get_my_profile, mec_or_pvl, MAX_PROFILES
+from mlva_scheme import load_scheme
+
+# Times every stage of the typing on synthetic cohorts and checks the profiles against the ground truth of the generator.
+# get_my_profile includes a second get_number_repeats, like in the pipeline.
+
+STAGES = ['search', 'parse', 'get_mlva_dict', 'get_number_repeats', 'get_my_profile']
+
+def parse_arguments(logo):
+    arg = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent(f"""
+        {colored(logo, 'red', attrs=["bold"])}
+        {colored('In silico MLVA typing for MRSA:', 'white', attrs=["bold", "underline"])}
+
+        Benchmarks the search and typing stages on synthetic assemblies with a known profile.
+        Exits with 1 if any isolate gets a different profile than it was built with.
+-----------------------------------------------------------------------------------
+        {colored('Example usage:', 'green', attrs=["bold", "underline"])}
+            python {os.path.abspath(__file__)}
+            --cohorts 10 100 1000 10000
+            --genome_size 100000
+            --output benchmark.tsv)
+-----------------------------------------------------------------------------------
+        """))
+    arg.add_argument("-c",
+                    "--cohorts",
+                    metavar="INT",
+                    help="Number of isolates of every cohort (default: 10 100)",
+                    type=int,
+                    nargs='+',
+                    default=[10, 100],
+                    required=False)
+    arg.add_argument("-s",
+                    "--engine",
+                    help="Search with blastn or with the built-in native search (default: native)",
+                    choices=['blastn', 'native'],
+                    default='native',
+                    required=False)
+    arg.add_argument("-pi",
+                    "--perc_identity",
+                    metavar="INT",
+                    help="Percentage of identity to use to search for in the primers",
+                    type=int,
+                    default=50,
+                    required=False)
+    arg.add_argument("-ms",
+                    "--memory_sample",
+                    metavar="INT",
+                    help="Number of isolates per cohort measured again for the peak memory of every stage (default: 5)",
+                    type=int,
+                    default=5,
+                    required=False)
+    arg.add_argument("-o",
+                    "--output",
+                    metavar="Path",
+                    help="Write the results as a tab separated table to this file",
+                    type=str,
+                    required=False)
+    synthetic_assemblies.add_generator_arguments(arg)
+    return arg.parse_args()
+
+class Stages(object):
+    # Runs the stages of one isolate one after the other, keeping the wall time of each
+    def __init__(self, engine, perc_identity, scheme, tmpdir):
+        self.engine, self.perc_identity, self.tmpdir, self.scheme = engine, perc_identity, tmpdir, scheme
+        self.subjects = {'primers': scheme.primer_file, 'repeat': scheme.repeat_file}
+        self.indexes = {search: native_search.load_subjects(pth) for search, pth in self.subjects.items()}
+
+    def search(self, records):
+        query = f"{self.tmpdir}/query.fasta"
+        if self.engine == 'blastn':
+            synthetic_assemblies.write_fasta(records, query)
+        for search, subject in self.subjects.items():
+            out = f"{self.tmpdir}/{search}-blastn.csv"
+            if self.engine == 'blastn':
+                subprocess.run(search_command('blastn', query, subject, out, self.perc_identity, 1), check=True)
+            else:
+                with open(out, 'w') as f:
+                    csv.writer(f).writerows(native_search.search_records(records, self.indexes[search], self.perc_identity))
+
+    def parse(self):
+        return [read_hits(f"{self.tmpdir}/{search}-blastn.csv") for search in ('primers', 'repeat')]
+
+    def run(self, records, timings=None): # Profile and MecA/PVL status, the wall time of every stage is added to timings
+        clock = [time.perf_counter()]
+        def lap(stage):
+            clock.append(time.perf_counter())
+            if timings is not None:
+                timings[stage].append(clock[-1] - clock[-2])
+        self.search(records)
+        lap('search')
+        df, df2 = self.parse()
+        lap('parse')
+        mlva_dict, support = get_all_possible_sizes(df, self.scheme, with_support=True)
+        lap('get_mlva_dict')
+        self.count_repeats(df, df2)
+        lap('get_number_repeats')
+        profiles = get_my_profile(self.scheme, mlva_dict, df, df2, support, MAX_PROFILES)
+        lap('get_my_profile')
+        return profiles[0], mec_or_pvl(self.scheme, mlva_dict)
+
+    def count_repeats(self, df, df2): # Every counted locus of the scheme, VNTR63_01
+        return {locus: get_number_repeats(df, df2, self.scheme, locus) for locus in self.scheme.counted}
+
+    def peak_memory(self, records): # Peak of the memory allocated during every stage, traced separately because tracing slows everything down
+        peaks, state = {}, {}
+        steps = [('search', lambda: self.search(records)),
+                 ('parse', lambda: state.update(dfs=self.parse())),
+                 ('get_mlva_dict', lambda: state.update(sizes=get_all_possible_sizes(state['dfs'][0], self.scheme, with_support=True))),
+                 ('get_number_repeats', lambda: self.count_repeats(state['dfs'][0], state['dfs'][1])),
+                 ('get_my_profile', lambda: get_my_profile(self.scheme, state['sizes'][0], state['dfs'][0], state['dfs'][1], state['sizes'][1], MAX_PROFILES))]
+        for stage, step in steps:
+            tracemalloc.start()
+            step()
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return peaks
+
+def run_cohort(stages, scheme, isolates, flags):
+    timings = {stage: [] for stage in STAGES}
+    memory = {stage: [] for stage in STAGES}
+    wrong = []
+    for n, (records, truth) in enumerate(synthetic_assemblies.generate_cohort(scheme, isolates, flags.seed, **synthetic_assemblies.generator_settings(flags))):
+        profile, mecpvl = stages.run(records, timings)
+        markers = {marker.marker: truth[marker.column] for marker in scheme.markers} # MecA and PVL status it was built with
+        if profile != truth['profile'] or any(mecpvl.get(marker) != status for marker, status in markers.items()):
+            wrong.append(truth['isolate'])
+            print(colored(f"{truth['isolate']}: {profile} {mecpvl} but built as {truth['profile']} {markers}", 'red'))
+        if n < flags.memory_sample:
+            for stage, peak in stages.peak_memory(records).items():
+                memory[stage].append(peak)
+    rows = []
+    for stage in STAGES:
+        latencies = np.array(timings[stage]) * 1000
+        rows.append(dict(isolates=isolates, stage=stage, total_s=round(latencies.sum() / 1000, 3),
+                         isolates_per_s=round(isolates / max(latencies.sum() / 1000, 1e-9), 1),
+                         p50_ms=round(np.percentile(latencies, 50), 2), p90_ms=round(np.percentile(latencies, 90), 2),
+                         p99_ms=round(np.percentile(latencies, 99), 2),
+                         peak_mb=round(max(memory[stage], default=0) / 1e6, 2), wrong_profiles=len(wrong)))
+    return rows
+
+def main():
+    current_file_path = os.path.abspath(__file__)
+    parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
+    flags = parse_arguments(getmylogo(os.path.join(parent_dir_path, "files", "logo.txt")))
+    mlva = load_scheme(flags.scheme)
+    scheme = synthetic_assemblies.Scheme(mlva)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stages = Stages(flags.engine, flags.perc_identity, mlva, tmpdir)
+        for isolates in flags.cohorts:
+            cohort = run_cohort(stages, scheme, isolates, flags)
+            print(pd.DataFrame(cohort).to_string(index=False))
+            rows.extend(cohort)
+    report = pd.DataFrame(rows)
+    print(f"Peak resident memory of the benchmark: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000:.0f} MB")
+    if flags.output is not None:
+        report.to_csv(flags.output, sep='\t', index=False)
+    if report['wrong_profiles'].sum() > 0:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
-import argparse, os, glob, subprocess, textwrap
+import argparse, os, csv, importlib.util, subprocess, sys, textwrap, time, concurrent.futures
 from pathlib import Path
 from termcolor import colored
-from tqdm import tqdm
+from mlva_executors import EXECUTORS, ARRAY_TIMEOUT, get_executor, clear_markers, write_marker
+from mlva_cache import ResultCache, write_manifest
+from mlva_metrics import NO_METRICS, Metrics, profiled
+from mlva_input import discover_inputs, isolate_name, compression, query_pipe, read_records
+from lazy_imports import lazy_import
+from repeat_windows import repeat_windows, window_records, remap_rows, write_counted_repeats
+from mlva_hits import HIT_FORMATS, hits_frame, hit_path, read_hits, write_hits, convert_hits, clear_hits
+from filter_mlva_blast import type_hits, mec_or_pvl, write_to_file, summary_rows, write_summary, MAX_PROFILES
+from mlva_scheme import load_scheme, DEFAULT_SCHEME
+
+native_search = lazy_import('native_search') # numpy and the native engine are only loaded when they search
 
 def getmylogo(pth):
     exec_globals = {}
@@ -28,9 +38,13 @@ def parse_arguments(logo):
     arg.add_argument("-i", 
                     "--input", 
                     metavar="Path", 
-                    help="Input directory with assembled fasta file", 
+                    help="Input directory with assembled fasta files (also .gz, .bgz or .zst), a fasta file or - for a list of files or fasta on stdin", 
                     type=str, 
                     required=True)
+    arg.add_argument("--multi_isolate", 
+                    help="The --input fasta holds several isolates, with >isolate|contig headers, every isolate is typed on its own", 
+                    action='store_true', 
+                    required=False)
     arg.add_argument("-o", 
                     "--output", 
                     metavar="Path", 
@@ -44,8 +58,110 @@ def parse_arguments(logo):
                     type=parse_percentage, 
                     default=50, 
                     required=False)
+    arg.add_argument("-e", 
+                    "--executor",
+                    help="Where to run the blast jobs: local processes or the LSF cluster, one job per search or (_array) one job array for all isolates (default: local)", 
+                    choices=sorted(EXECUTORS), 
+                    default='local', 
+                    required=False)
+    arg.add_argument("-w", 
+                    "--workers",
+                    metavar="INT", 
+                    help="Maximum number of blast jobs running at the same time (default: number of cores / threads)", 
+                    type=int, 
+                    default=None, 
+                    required=False)
+    arg.add_argument("--isolates_per_task", 
+                    metavar="INT", 
+                    help="With the lsf_array and local_array executors, search this many isolates in every task of the job array (default: 10)", 
+                    type=int, 
+                    default=10, 
+                    required=False)
+    arg.add_argument("--array_timeout", 
+                    metavar="Seconds", 
+                    help=f"With the lsf_array and local_array executors, the isolates of tasks that did not finish within this many seconds fail (default: {ARRAY_TIMEOUT})", 
+                    type=int, 
+                    default=ARRAY_TIMEOUT, 
+                    required=False)
+    arg.add_argument("-t", 
+                    "--threads",
+                    metavar="INT", 
+                    help="Number of threads given to every blastn job (default: 1)", 
+                    type=int, 
+                    default=1, 
+                    required=False)
+    arg.add_argument("-s", 
+                    "--engine",
+                    help="Search with blastn or with the built-in native search (default: blastn)", 
+                    choices=['blastn', 'native'], 
+                    default='blastn', 
+                    required=False)
+    arg.add_argument("-b", 
+                    "--batch_size",
+                    metavar="INT", 
+                    help="Blast this many isolates together in one blastn job against primers and repeats at once (default: one job per isolate and search)", 
+                    type=int, 
+                    default=None, 
+                    required=False)
+    arg.add_argument("--stream", 
+                    help="Search and type every isolate in one go, the hits go straight from the search into the typing (local executor only)", 
+                    action='store_true', 
+                    required=False)
+    arg.add_argument("--scheme", 
+                    metavar="Path", 
+                    help="JSON definition of the MLVA scheme: primers, repeats, loci, bitscore cutoffs, bins and markers (default: files/mrsa_scheme.json)", 
+                    type=str, 
+                    default=DEFAULT_SCHEME, 
+                    required=False)
+    arg.add_argument("--two_pass", 
+                    help="Search the repeats only in the windows around the VNTR63_01 forward primer hits, found by searching the primers first (not with --batch_size)", 
+                    action='store_true', 
+                    required=False)
+    arg.add_argument("--keep_csv", 
+                    help="With --stream, also write the hit files (in --hit_format)", 
+                    action='store_true', 
+                    required=False)
+    arg.add_argument("--hit_format", 
+                    help="Store the hits as the blastn csv files, or typed as npz (numpy) or feather (pyarrow) files that the typing loads without parsing (default: csv)", 
+                    choices=HIT_FORMATS, 
+                    default='csv', 
+                    required=False)
+    arg.add_argument("-c", 
+                    "--cache",
+                    metavar="Path", 
+                    help="Directory with results of earlier runs, isolates that did not change are taken from here instead of searched again", 
+                    type=str, 
+                    default=None, 
+                    required=False)
+    arg.add_argument("--metrics",
+                    metavar="Path", 
+                    help="Append submission and waiting time per isolate (and with --stream the time of every stage) to this JSON lines file", 
+                    type=str, 
+                    default=None, 
+                    required=False)
+    arg.add_argument("--profile",
+                    metavar="Path", 
+                    help="With --stream, write cProfile stats of every worker to this file, ending in .PID", 
+                    type=str, 
+                    default=None, 
+                    required=False)
+    arg.add_argument("--cache_size",
+                    metavar="GB", 
+                    help="Maximum size of the cache, the least recently used results are removed after the run (default: 10)", 
+                    type=float, 
+                    default=10, 
+                    required=False)
 
-    return arg.parse_args()
+    flags = arg.parse_args()
+    if flags.two_pass and flags.batch_size is not None:
+        arg.error("--two_pass searches one isolate at a time, it doesn't work with --batch_size")
+    if flags.stream and flags.batch_size is not None:
+        arg.error("--stream searches and types one isolate at a time, it doesn't work with --batch_size")
+    if flags.stream and flags.executor != 'local':
+        arg.error("--stream only works with the local executor")
+    if flags.hit_format == 'feather' and importlib.util.find_spec('pyarrow') is None:
+        arg.error("--hit_format feather needs pyarrow (pip install pyarrow), npz only needs numpy")
+    return flags
 
 def determine_outdir(flg_out):
     if flg_out == None:
@@ -65,45 +181,294 @@ def parse_percentage(value):
     else:
         raise argparse.ArgumentTypeError("Percentage must be in the range 0-100")
 
+def search_command(engine, query, subject, out, perc_identity, threads):
+    if engine == 'native': # Takes the same arguments as blastn
+        program = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'native_search.py')]
+    else:
+        program = ['blastn']
+    cmd = program + ['-query', query,
+                     '-subject', subject,
+                     '-out', out,
+                     '-word_size', '7',
+                     '-perc_identity', str(perc_identity),
+                     '-num_threads', str(threads),
+                     '-outfmt', '10']
+    if engine == 'blastn' and compression(query) is not None: # blastn can't read compressed fasta, it gets the query on stdin instead
+        cmd[cmd.index(query)] = '-'
+        return query_pipe(query, cmd)
+    return cmd
+
+COMPRESSION_RATIO = 4 # Assumed size of a decompressed assembly relative to its compressed file, for the resources of job array tasks
+
+def input_size(pth):
+    return os.path.getsize(pth) * (COMPRESSION_RATIO if compression(pth) is not None else 1)
+
+def two_pass_command(engine, query, scheme_file, outputname, perc_identity, threads): # Both searches in one job, the second needs the first
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'repeat_windows.py'),
+            '-engine', engine,
+            '-query', query,
+            '-scheme', scheme_file,
+            '-primer_out', f"{outputname}_primers-blastn.csv",
+            '-repeat_out', f"{outputname}_repeat-blastn.csv",
+            '-perc_identity', str(perc_identity),
+            '-num_threads', str(threads)]
+
+def write_batch_query(batch, batch_query): # Every contig gets the isolate number as prefix so the hits can be split again
+    with open(batch_query, 'w') as out:
+        for n, key in enumerate(batch):
+            for name, seq in read_records(key): # Compressed assemblies as well
+                out.write(f">mlva{n}__{name}\n{seq}\n")
+
+def write_batch_subject(primer_file, sequence_file, batch_subject):
+    with open(batch_subject, 'w') as out:
+        for fasta in (primer_file, sequence_file):
+            with open(fasta) as f:
+                out.write(f.read().rstrip('\n') + '\n')
+
+def split_batch_hits(batch_out, outputnames, primer_names): # Writes the same per isolate csv files the unbatched blast would have
+    primer_out = [open(f"{o}_primers-blastn.csv", 'w') for o in outputnames]
+    repeat_out = [open(f"{o}_repeat-blastn.csv", 'w') for o in outputnames]
+    with open(batch_out) as f:
+        for line in f:
+            tag, hit = line.split('__', 1)
+            n = int(tag[len('mlva'):])
+            if hit.split(',', 2)[1] in primer_names:
+                primer_out[n].write(hit)
+            else:
+                repeat_out[n].write(hit)
+    for out in primer_out + repeat_out:
+        out.close()
+
+def hit_files(outputname, hit_format='csv'):
+    return {f"{search}-blastn.{hit_format}": hit_path(outputname, search, hit_format) for search in ('primers', 'repeat')}
+
+def hit_key(cache, flags, key, scheme): # Everything the blast output depends on, the digest covers the primers and repeats of the scheme
+    return cache.key([key], scheme=scheme.digest, perc_identity=flags.perc_identity, engine=flags.engine, two_pass=flags.two_pass, hit_format=flags.hit_format)
+
+def profile_key(cache, flags, key, scheme): # And everything the typing depends on, the digest covers all files of the scheme
+    return cache.key([key], scheme=scheme.digest, perc_identity=flags.perc_identity, engine=flags.engine, two_pass=flags.two_pass, hit_format=flags.hit_format, max_profiles=MAX_PROFILES)
+
+_SUBJECT_INDEX = {} # Native search index per subject file, built once per worker process
+
+def stream_hits(engine, query, subject, perc_identity, threads): # Yields hit rows while the search is still running
+    if engine == 'native':
+        if subject not in _SUBJECT_INDEX:
+            _SUBJECT_INDEX[subject] = native_search.load_subjects(subject)
+        for row in native_search.search_records(native_search.read_fasta(query), _SUBJECT_INDEX[subject], perc_identity):
+            yield row
+        return
+    process = subprocess.Popen(search_command(engine, query, subject, '-', perc_identity, threads), stdout=subprocess.PIPE, universal_newlines=True)
+    for row in csv.reader(process.stdout):
+        yield row
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, engine)
+
+def window_hits(engine, key, repeat_subject, primer_rows, perc_identity, threads, outputname, scheme): # Second search of --two_pass, in contig coordinates
+    records = read_records(key)
+    windows = window_records(records, repeat_windows(primer_rows, {name: len(seq) for name, seq in records}, scheme))
+    if len(windows) == 0:
+        return []
+    with open(f"{outputname}_windows.fasta", 'w') as f:
+        for name, seq in windows:
+            f.write(f">{name}\n{seq}\n")
+    try:
+        return list(remap_rows(stream_hits(engine, f"{outputname}_windows.fasta", repeat_subject, perc_identity, threads)))
+    finally:
+        os.remove(f"{outputname}_windows.fasta")
+
+def stream_isolate(engine, key, subject, primer_names, perc_identity, threads, outputname, typing_outdir, scheme_file, keep_csv, cache=None, keys=None, metrics=NO_METRICS, repeat_subject=None, hit_format='csv'):
+    basename = os.path.basename(outputname)
+    with metrics.stage(basename, 'isolate') as counts:
+        rows, counts['status'] = stream_and_type(engine, key, subject, primer_names, perc_identity, threads, outputname, typing_outdir, scheme_file, keep_csv, cache, keys, metrics, repeat_subject, hit_format)
+    return rows, counts['status']
+
+def stream_and_type(engine, key, subject, primer_names, perc_identity, threads, outputname, typing_outdir, scheme_file, keep_csv, cache, keys, metrics, repeat_subject=None, hit_format='csv'):
+    basename = os.path.basename(outputname)
+    scheme = load_scheme(scheme_file) # Loaded by main before the workers were forked
+    if cache is not None: # keys holds the hit key and the profile key of this isolate
+        rows = cache.get_rows(keys[1])
+        if rows is not None and cache.get(keys[1], dict(hit_files(outputname, hit_format) if keep_csv else {}, **{'MLVA.txt': f"{typing_outdir}/{basename}_MLVA.txt"})):
+            return rows, 'profile reused'
+        status = 'hits reused' if cache.get(keys[0], hit_files(outputname, hit_format)) else 'computed'
+    if cache is not None and status == 'hits reused':
+        with metrics.stage(basename, 'load_hits'):
+            primer_hits, repeat_hits = read_hits(hit_path(outputname, 'primers', hit_format)), read_hits(hit_path(outputname, 'repeat', hit_format))
+    else:
+        with metrics.stage(basename, 'search', engine=engine) as counts: # CPU time only covers the native engine, blastn runs in a child process
+            keep_files = keep_csv or cache is not None # The cache is filled from the hit files
+            primer_rows, repeat_rows = search_isolate(engine, key, subject, primer_names, perc_identity, threads, outputname, keep_files and hit_format == 'csv', repeat_subject, scheme)
+            counts['primer_hits'], counts['repeat_hits'] = len(primer_rows), len(repeat_rows)
+        primer_hits, repeat_hits = primer_rows, repeat_rows # type_hits makes the typed tables
+        if keep_files and hit_format != 'csv':
+            with metrics.stage(basename, 'store_hits'):
+                primer_hits, repeat_hits = hits_frame(primer_rows), hits_frame(repeat_rows)
+                write_hits(primer_hits, hit_path(outputname, 'primers', hit_format))
+                write_hits(repeat_hits, hit_path(outputname, 'repeat', hit_format))
+    profiles_in_a_list, MLVA_dict = type_hits(primer_hits, repeat_hits, scheme, metrics=metrics, isolate=basename)
+    with metrics.stage(basename, 'write'):
+        output_mecpvl = mec_or_pvl(scheme, MLVA_dict)
+        write_to_file(profiles_in_a_list, scheme, MLVA_dict, basename, typing_outdir, output_mecpvl)
+    rows = summary_rows(basename, profiles_in_a_list, output_mecpvl, MLVA_dict, scheme)
+    if cache is None:
+        return rows, 'computed'
+    cache.put(keys[0], hit_files(outputname, hit_format))
+    cache.put_rows(keys[1], rows, dict(hit_files(outputname, hit_format), **{'MLVA.txt': f"{typing_outdir}/{basename}_MLVA.txt"}))
+    if not keep_csv:
+        for f in hit_files(outputname, hit_format).values():
+            os.remove(f)
+    return rows, status
+
+def search_isolate(engine, key, subject, primer_names, perc_identity, threads, outputname, keep_csv, repeat_subject=None, scheme=None):
+    # Primers and repeats come from one search against both, or with repeat_subject (--two_pass) subject only holds the primers
+    # and the repeats are searched afterwards, around the primer hits
+    primer_rows, repeat_rows = [], []
+    if keep_csv:
+        primer_out, repeat_out = open(f"{outputname}_primers-blastn.csv", 'w'), open(f"{outputname}_repeat-blastn.csv", 'w')
+    hits = stream_hits(engine, key, subject, perc_identity, threads)
+    if repeat_subject is not None: # The windows need all primer hits first
+        hits = list(hits)
+        hits += window_hits(engine, key, repeat_subject, hits, perc_identity, threads, outputname, scheme)
+    for row in hits:
+        if row[1] in primer_names:
+            primer_rows.append(row)
+            if keep_csv:
+                primer_out.write(','.join(row) + '\n')
+        else:
+            repeat_rows.append(row)
+            if keep_csv:
+                repeat_out.write(','.join(row) + '\n')
+    if keep_csv:
+        primer_out.close()
+        repeat_out.close()
+    return primer_rows, repeat_rows
+
+def stream_all(flags, list_of_files, outputnames, scheme, outdir, cache=None, manifest=None):
+    typing_outdir = f"{os.path.dirname(outdir)}/mlva_typing"
+    Path(typing_outdir).mkdir(parents=True, exist_ok=True)
+    primer_names = set(scheme.primers)
+    if flags.two_pass: # The windows are only searched for the repeat units the typing counts
+        subject, repeat_subject = scheme.primer_file, f"{outdir}/mlva_counted_repeats.fasta"
+        write_counted_repeats(scheme, repeat_subject)
+    else:
+        subject, repeat_subject = f"{outdir}/mlva_primers_and_repeats.fasta", None
+        write_batch_subject(scheme.primer_file, scheme.repeat_file, subject)
+    workers = flags.workers or max(1, (os.cpu_count() or 1) // flags.threads)
+    failed, rows = [], []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for key, outputname in zip(list_of_files, outputnames):
+            keys = None if cache is None else (hit_key(cache, flags, key, scheme), profile_key(cache, flags, key, scheme))
+            futures[pool.submit(profiled, flags.profile, True, stream_isolate, flags.engine, key, subject, primer_names, flags.perc_identity, flags.threads,
+                                outputname, typing_outdir, flags.scheme, flags.keep_csv, cache, keys, Metrics(flags.metrics), repeat_subject, flags.hit_format)] = key, keys
+        for future in concurrent.futures.as_completed(futures):
+            key, keys = futures[future]
+            try:
+                isolate_rows, status = future.result()
+                rows.extend(isolate_rows)
+                print(f"profile for {key}: {isolate_rows[0]['profile']}")
+                if cache is not None:
+                    manifest.append((isolate_name(key), keys[1], status))
+            except Exception as e:
+                print(f"search failed for {key}: {e}")
+                failed.append(isolate_name(key))
+    write_summary(rows, typing_outdir, scheme)
+    return failed
+
+def finish_cache(cache, manifest, outdir):
+    if cache is None:
+        return
+    write_manifest(manifest, f"{outdir}/cache_manifest.tsv")
+    evicted = cache.evict()
+    if len(evicted) > 0:
+        print(f"Removed {len(evicted)} least recently used results from the cache")
+
 def main():
     current_file_path = os.path.abspath(__file__)
     parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
-    primer_file = os.path.join(parent_dir_path, "files", "mrsa_mlva_primers.fasta")
-    sequence_file = os.path.join(parent_dir_path, "files", "mrsa_mlva_sequenties.fasta")
     logo_path = os.path.join(parent_dir_path, "files", "logo.txt")
     flags = parse_arguments(getmylogo(logo_path))
+    scheme = load_scheme(flags.scheme, flags.cache) # With --cache the compiled scheme is kept next to the results
+    primer_file, sequence_file = scheme.primer_file, scheme.repeat_file
     outdir = determine_outdir(flags.output)
 
-    list_of_files = glob.glob(os.path.abspath(f"{flags.input}/*"))
-    wait_for_jobs = []
-    for key in list_of_files:
-        basename = os.path.splitext(os.path.basename(key))[0]
-        outputname = f"{outdir}/{basename}"
-        ### blast for primers:
-        subprocess_cmd_primer_blast2input = f"bsub -q bio -n 1 -R 'rusage[mem=12G]' -R 'span[hosts=1]' -W 15 -M 16000 \
-            \"blastn -query {key} \
-            -subject {primer_file} \
-            -out {outputname}_primers-blastn.csv \
-            -word_size 7 \
-            -perc_identity {flags.perc_identity} \
-            -outfmt 10\""
-        sub1 = subprocess.Popen(subprocess_cmd_primer_blast2input, shell=True, stdout=subprocess.PIPE)
-        ### blast for VNTR repeat sequences - used for VNTR63_01: 
-        subprocess_cmd_repeat_blast2input = f"bsub -q bio -n 1 -R 'rusage[mem=12G]' -R 'span[hosts=1]' -W 15 -M 16000 \
-            \"blastn -query {key} \
-            -subject {sequence_file} \
-            -out {outputname}_repeat-blastn.csv \
-            -word_size 7 \
-            -perc_identity {flags.perc_identity} \
-            -outfmt 10\""
-        sub2 = subprocess.Popen(subprocess_cmd_repeat_blast2input, shell=True, stdout=subprocess.PIPE)
-        wait_for_jobs.append(sub1)
-        wait_for_jobs.append(sub2)
-    print(f"Jobs sent to cluster for {len(list_of_files)} isolates.")
+    list_of_files = discover_inputs(flags.input, f"{os.path.dirname(outdir)}/input", multi_isolate=flags.multi_isolate) # Isolates of a multi-isolate fasta are split into input/
+    outputnames = [f"{outdir}/{isolate_name(key)}" for key in list_of_files]
+    cache = None if flags.cache is None else ResultCache(flags.cache, int(flags.cache_size * 1e9))
+    manifest = []
+    for outputname in outputnames: # Also the hits of another --hit_format, which the typing would find as well
+        clear_hits(outputname)
+    if flags.stream:
+        failed = stream_all(flags, list_of_files, outputnames, scheme, outdir, cache, manifest)
+        finish_cache(cache, manifest, outdir)
+        if len(failed) > 0:
+            print(f"Typing failed for {len(failed)} isolates: {', '.join(failed)}")
+            raise SystemExit(1)
+        return
+    metrics = Metrics(flags.metrics)
+    executor = get_executor(flags.executor, flags.workers, flags.threads, isolates_per_task=flags.isolates_per_task, workdir=f"{outdir}/array", timeout=flags.array_timeout)
+    for outputname in outputnames:
+        clear_markers(outputname) # Left over from a previous run, typing should wait for this run
+    hit_keys = {}
+    if cache is not None: # Unchanged isolates get their blast output from the cache and are not searched again
+        for key, outputname in zip(list(list_of_files), list(outputnames)):
+            hit_keys[outputname] = hit_key(cache, flags, key, scheme)
+            if cache.get(hit_keys[outputname], hit_files(outputname, flags.hit_format)):
+                write_marker(outputname, True)
+                manifest.append((isolate_name(key), hit_keys[outputname], 'hits reused'))
+                list_of_files.remove(key)
+                outputnames.remove(outputname)
+        print(f"{len(manifest)} isolates taken from the cache in {cache.cache_dir}")
+    batches = {}
+    start = time.time()
+    if flags.two_pass:
+        for key, outputname in zip(list_of_files, outputnames):
+            executor.submit(outputname, two_pass_command(flags.engine, key, flags.scheme, outputname, flags.perc_identity, flags.threads), input_size(key))
+    elif flags.batch_size is None:
+        for key, outputname in zip(list_of_files, outputnames):
+            ### blast for primers:
+            executor.submit(outputname, search_command(flags.engine, key, primer_file, f"{outputname}_primers-blastn.csv", flags.perc_identity, flags.threads), input_size(key))
+            ### blast for VNTR repeat sequences - used for VNTR63_01: 
+            executor.submit(outputname, search_command(flags.engine, key, sequence_file, f"{outputname}_repeat-blastn.csv", flags.perc_identity, flags.threads), input_size(key))
+    else: # One blastn job per batch of isolates against primers and repeats together
+        primer_names = set(scheme.primers)
+        batch_subject = f"{outdir}/mlva_primers_and_repeats.fasta"
+        write_batch_subject(primer_file, sequence_file, batch_subject)
+        for b in range(0, len(list_of_files), flags.batch_size):
+            batch_name = f"{outdir}/batch_{b // flags.batch_size}"
+            write_batch_query(list_of_files[b:b + flags.batch_size], f"{batch_name}.fasta")
+            batches[batch_name] = outputnames[b:b + flags.batch_size]
+            executor.submit(batch_name, search_command(flags.engine, f"{batch_name}.fasta", batch_subject, f"{batch_name}-blastn.csv", flags.perc_identity, flags.threads), input_size(f"{batch_name}.fasta"))
+    executor.flush() # The array executors submit everything at once
+    metrics.record(None, 'submit', wall_s=round(time.time() - start, 3), isolates=len(list_of_files), executor=executor.name)
+    print(f"Jobs sent to {executor.name} executor for {len(list_of_files)} isolates.")
     print('waiting for blast output...')
-    for s in tqdm(wait_for_jobs):
-        s.communicate()
-
+    failed = []
+    from tqdm import tqdm # Not needed for --help or --stream
+    progress = tqdm(total=len(list_of_files))
+    for group, success in executor.as_completed():
+        if group in batches:
+            if success:
+                split_batch_hits(f"{group}-blastn.csv", batches[group], primer_names)
+            for f in (f"{group}.fasta", f"{group}-blastn.csv"):
+                if os.path.exists(f):
+                    os.remove(f)
+        for outputname in batches.get(group, [group]):
+            if success:
+                convert_hits(outputname, flags.hit_format)
+            if success and cache is not None:
+                cache.put(hit_keys[outputname], hit_files(outputname, flags.hit_format))
+                manifest.append((os.path.basename(outputname), hit_keys[outputname], 'computed'))
+            write_marker(outputname, success) # Typing of this isolate can start now
+            metrics.record(os.path.basename(outputname), 'wait', wall_s=round(time.time() - start, 3), success=success, executor=executor.name)
+            if not success:
+                failed.append(os.path.basename(outputname))
+            progress.update(1)
+    progress.close()
+    executor.shutdown()
+    finish_cache(cache, manifest, outdir)
+    if len(failed) > 0:
+        print(f"blastn failed for {len(failed)} isolates: {', '.join(failed)}")
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import argparse, os, subprocess, tempfile, textwrap
+from termcolor import colored
+import native_search
+from blast_mrsa_mlva import search_command
+from mlva_input import discover_inputs, isolate_name
+from mlva_hits import hits_frame, read_hits
+from filter_mlva_blast import getmylogo, type_hits
+from mlva_scheme import load_scheme, DEFAULT_SCHEME
+
+# Concordance check of the native search against blastn: hit by hit for everything the typing can use and profile by profile.
+
+HIT_KEY = ['qseqid','sseqid','qstart','qend','sstart','send']
+
+def parse_arguments(logo):
+    arg = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent(f"""
+        {colored(logo, 'red', attrs=["bold"])}
+        {colored('In silico MLVA typing for MRSA:', 'white', attrs=["bold", "underline"])}
+
+        Compares the hits and MLVA profiles of the native search with those of blastn.
+        Exits with 1 if any isolate gets a different profile.
+-----------------------------------------------------------------------------------
+        {colored('Example usage:', 'green', attrs=["bold", "underline"])}
+            python {os.path.abspath(__file__)}
+            --input example/input_fasta/
+            --blastn example/output/blastn/)
+-----------------------------------------------------------------------------------
+        """))
+    arg.add_argument("-i",
+                    "--input",
+                    metavar="Path",
+                    help="Input directory with assembled fasta file",
+                    type=str,
+                    required=True)
+    arg.add_argument("-b",
+                    "--blastn",
+                    metavar="Path",
+                    help="Directory with existing blastn output of blast_mrsa_mlva.py, blastn is run when not given",
+                    type=str,
+                    required=False)
+    arg.add_argument("-pi",
+                    "--perc_identity",
+                    metavar="INT",
+                    help="Percentage of identity to use to search for in the primers",
+                    type=int,
+                    default=50,
+                    required=False)
+    arg.add_argument("-ms",
+                    "--min_bitscore",
+                    metavar="FLOAT",
+                    help="Only compare hits with at least this bitscore, the lowest typing cutoff by default",
+                    type=float,
+                    default=15,
+                    required=False)
+    arg.add_argument("--scheme",
+                    metavar="Path",
+                    help="JSON definition of the MLVA scheme (default: files/mrsa_scheme.json)",
+                    type=str,
+                    default=DEFAULT_SCHEME,
+                    required=False)
+
+    return arg.parse_args()
+
+def hit_frame(hits, min_bitscore):
+    return hits.loc[hits['bitscore'] >= min_bitscore]
+
+def compare_hits(blast_df, native_df):
+    merged = blast_df.merge(native_df, on=HIT_KEY, how='outer', suffixes=('_blastn', '_native'), indicator=True)
+    shared = merged.loc[merged['_merge'] == 'both']
+    max_diff = (shared['bitscore_blastn'] - shared['bitscore_native']).abs().max() if len(shared) > 0 else 0.0
+    return len(shared), (merged['_merge'] == 'left_only').sum(), (merged['_merge'] == 'right_only').sum(), max_diff
+
+def main():
+    current_file_path = os.path.abspath(__file__)
+    parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
+    flags = parse_arguments(getmylogo(os.path.join(parent_dir_path, "files", "logo.txt")))
+    scheme = load_scheme(flags.scheme)
+    primer_file, sequence_file = scheme.primer_file, scheme.repeat_file
+    indexes = {'primers': native_search.load_subjects(primer_file), 'repeat': native_search.load_subjects(sequence_file)}
+    subjects = {'primers': primer_file, 'repeat': sequence_file}
+
+    discordant = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for file in discover_inputs(flags.input, f"{tmpdir}/input"):
+            basename = isolate_name(file)
+            records = native_search.read_fasta(file)
+            hits = {}
+            for search in ('primers', 'repeat'):
+                if flags.blastn is not None:
+                    blast_csv = f"{flags.blastn}/{basename}_{search}-blastn.csv"
+                else:
+                    blast_csv = f"{tmpdir}/{basename}_{search}-blastn.csv"
+                    subprocess.run(search_command('blastn', file, subjects[search], blast_csv, flags.perc_identity, 1), check=True)
+                blast_hits = read_hits(blast_csv)
+                native_hits = hits_frame(native_search.search_records(records, indexes[search], flags.perc_identity))
+                hits[search] = (blast_hits, native_hits)
+                shared, blast_only, native_only, max_diff = compare_hits(hit_frame(blast_hits, flags.min_bitscore), hit_frame(native_hits, flags.min_bitscore))
+                print(f"{basename} {search}: {shared} shared hits, {blast_only} only in blastn, {native_only} only native, max bitscore difference {max_diff:.1f}")
+            profiles = [type_hits(hits['primers'][engine], hits['repeat'][engine], scheme)[0] for engine in (0, 1)]
+            if sorted(profiles[0]) == sorted(profiles[1]):
+                print(colored(f"{basename}: same profile {', '.join(profiles[0])}", 'green'))
+            else:
+                discordant += 1
+                print(colored(f"{basename}: blastn {', '.join(profiles[0])} but native {', '.join(profiles[1])}", 'red'))
+    if discordant > 0:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
-import argparse, os.path, csv, textwrap, glob
-import pandas as pd
-import numpy as np
+import argparse, os.path, sys, textwrap, heapq, time, concurrent.futures
 from pathlib import Path
 from termcolor import colored
-from tqdm import tqdm
+from lazy_imports import lazy_import
+from mlva_executors import marker_path
+from mlva_metrics import NO_METRICS, Metrics, profiled
+from mlva_input import discover_inputs, isolate_name
+from mlva_hits import typed_hits, hits_frame, find_hits, read_hits
+from mlva_scheme import load_scheme, DEFAULT_SCHEME, NO_BIN, NOT_IN_SCHEME, FORWARD, REVERSE
 
-#notes It still crashes if it cant find the forward VNTR63 primer (local variable 'forward_pos1' referenced before assignment), in get_number_repeats
+#notes Check if the sizes found are at locations within range of their repeat sequences. Currently only done for the counted loci of the scheme (VNTR63_01)
 
-#notes Check if the sizes found are at locations within range of their repeat sequences. Currently only done for VNTR63_01
-
-#notes if there are overlapping repeat sequences it cant tell the the right order, so it should only do this per contig found, then pick the one with the highest bitscore
+MAX_PROFILES = 100 # Most profiles written for an isolate when several loci have more than one possible bin
+pd = lazy_import('pandas') # Imported on first use, not for --help or while waiting for blast
+np = lazy_import('numpy')
 
 def getmylogo(pth):
     exec_globals = {}
@@ -56,11 +59,18 @@ def parse_arguments(logo):
         "-i",
         "--input",
         metavar="Name",
-        help="The original fasta input directory",
+        help="The original fasta input directory or fasta file",
         type=str,
         required=True,
     )
 
+    arg.add_argument(
+        "--multi_isolate",
+        help="The --input fasta holds several isolates, with >isolate|contig headers, as given to blast_mrsa_mlva.py",
+        action='store_true',
+        required=False,
+    )
+
     arg.add_argument(
         "-o",
         "--output",
@@ -70,6 +80,74 @@ def parse_arguments(logo):
         required=False,
     )
 
+    arg.add_argument(
+        "-w",
+        "--wait",
+        metavar="Seconds",
+        help="Type every isolate as soon as blast_mrsa_mlva.py marks its blast output as done, waiting at most this many seconds",
+        type=int,
+        required=False,
+    )
+
+    arg.add_argument(
+        "--blast_pid",
+        metavar="PID",
+        help="With --wait: process ID of blast_mrsa_mlva.py, stop waiting as soon as it exits instead of at the timeout",
+        type=int,
+        required=False,
+    )
+
+    arg.add_argument(
+        "-m",
+        "--max_profiles",
+        metavar="INT",
+        help=f"Write at most this many profiles per isolate when loci have several possible bins, best supported by the primer bitscores first (default: {MAX_PROFILES})",
+        type=int,
+        default=MAX_PROFILES,
+        required=False,
+    )
+
+    arg.add_argument(
+        "--scheme",
+        metavar="Name",
+        help="JSON definition of the MLVA scheme: primers, loci, bitscore cutoffs, bins and markers (default: files/mrsa_scheme.json)",
+        type=str,
+        default=DEFAULT_SCHEME,
+        required=False,
+    )
+
+    arg.add_argument(
+        "--workers",
+        metavar="INT",
+        help="Number of processes typing isolates in parallel (default: 1)",
+        type=int,
+        default=1,
+        required=False,
+    )
+
+    arg.add_argument(
+        "--no_txt",
+        help="Only write mlva_summary.tsv (and .parquet), no *_MLVA.txt file per isolate",
+        action='store_true',
+        required=False,
+    )
+
+    arg.add_argument(
+        "--metrics",
+        metavar="Name",
+        help="Append wall time, CPU time, hit counts and peak memory of every stage of every isolate to this JSON lines file",
+        type=str,
+        required=False,
+    )
+
+    arg.add_argument(
+        "--profile",
+        metavar="Name",
+        help="Write cProfile stats of the typing to this file (one file per process, ending in .PID, with --workers)",
+        type=str,
+        required=False,
+    )
+
     return arg.parse_args()
 
 def determine_outdir(flg_out):
@@ -83,249 +161,152 @@ def determine_outdir(flg_out):
         print(f"Output directory: {outdir}")
     return outdir
 
-def csv_to_list(file):
-    with open(file) as f:
-        if os.path.getsize(file) > 0:
-            reader = csv.reader(f)
-            data = list(reader)
-            return data
-
-def determine_repeats_inrange(for1, for2, repeats): # This returns 99 if no primers are found
-    repeat_sequence_in_range_fc = []
-    for f in for1:
-        for seq in repeats:
-            if int(f)-int(seq.split('-')[0]) > 0 and int(f)-int(seq.split('-')[0]) <= 1200:
-                repeat_sequence_in_range_fc.append(seq)
-    for f in for2:
-        for seq in repeats:
-            if int(f)-int(seq.split('-')[0]) <= 0 and int(f)-int(seq.split('-')[0]) >= -1200:
-                repeat_sequence_in_range_fc.append(seq)
-    return repeat_sequence_in_range_fc
-
-def determine_chain(repeats):
-    sorted_range_list = sorted(repeats, key=lambda x: int(x.split('-')[0])) # Sort all of the ranges with the lowest value to highest starting value
-    if len(sorted_range_list) > 0:
-        repeat_counter = 1
-        for i in range(len(sorted_range_list) - 1):
-            current_element = sorted_range_list[i]
-            next_element = sorted_range_list[i + 1]
-            current_end = int(current_element.split('-')[1])
-            next_start = int(next_element.split('-')[0])
-            if current_end < next_start: #This is where you keep counting if the end matches the next start.
-                ce_check = int(current_element.split('-')[1]) + 1 # current end to check, so +1 to equal to next start
-                ns_check = int(next_element.split('-')[0]) # next start to check
-                if ce_check == ns_check:
-                    repeat_counter += 1
-                elif abs(ns_check - ce_check) <=2:
-                    repeat_counter += 1
-                    print('VNTR63 repeat sequence not exactly sequential')
-
-        return str(repeat_counter)
+def determine_repeats_inrange(for1, for2, repeat_starts, max_product_size): # Mask of the repeats within range of a forward primer hit on the same contig
+    upstream = np.asarray(for1)[:, None] - repeat_starts[None, :]
+    downstream = np.asarray(for2)[:, None] - repeat_starts[None, :]
+    return (((upstream > 0) & (upstream <= max_product_size)).any(axis=0) |
+            ((downstream <= 0) & (downstream >= -max_product_size)).any(axis=0))
+
+def determine_chain(starts, ends, bitscores, locus='VNTR63_01'): # Number of repeats and summed bitscore of the best chain of consecutive repeats
+    order = np.lexsort((ends, starts)) # Sort all of the ranges with the lowest value to highest starting value
+    starts, ends, bitscores = starts[order], ends[order], bitscores[order]
+    gap = starts[1:] - (ends[:-1] + 1) # 0 when the next repeat starts right after the current one ends
+    linked = (ends[:-1] < starts[1:]) & (gap <= 2)
+    if (linked & (gap > 0)).any():
+        print(f"{locus} repeat sequence not exactly sequential")
+    chain = np.concatenate(([0], np.cumsum(~linked))) # every unlinked repeat starts a new chain
+    chain_bitscores = np.bincount(chain, weights=bitscores)
+    best = int(np.argmax(chain_bitscores))
+    return int(np.bincount(chain)[best]), chain_bitscores[best]
+
+def get_number_repeats(dataframe, dataframe_repeat, scheme, locus): # Number of repeats as an int, NO_BIN when they can't be counted
+    # A counted locus (VNTR63_01) is typed by its number of repeats, because its reverse primer can't be found in about 30% of the isolates
+    counted = scheme.counted[locus]
+    dataframe = typed_hits(dataframe)
+    dataframe = dataframe.loc[dataframe['bitscore'].values >= counted.forward_min_bitscore]
+    primers = scheme.primer_ids(dataframe['sseqid'])
+    dataframe_repeat = typed_hits(dataframe_repeat)
+    dataframe_repeat = dataframe_repeat.loc[(dataframe_repeat['bitscore'].values >= counted.repeat_min_bitscore) &
+                                            (scheme.repeat_ids(dataframe_repeat['sseqid']) == counted.repeat)]
+    forward = dataframe.loc[primers == counted.forward]
+    shared_list = set(forward['qseqid']) & set(dataframe.loc[primers == counted.reverse, 'qseqid']) # contigs which have results for both forward and reverse
+    if len(shared_list) == 0: # This likely means that the reverse primer wasn't found! Which is expected for 63_01
+        if len(forward) == 0:
+            print(f"Not even forward primer found for {scheme.primers[counted.forward]}, can't continue")
+            return NO_BIN
     else:
-        return '99'
-
-def get_number_repeats(dataframe, dataframe_repeat, fname, rname, bitscori, bitscori_r):
-    dataframe = dataframe.astype({'bitscore':'float'})
-    dataframe = dataframe.loc[dataframe['bitscore'] >= bitscori]
-    dataframe_repeat = dataframe_repeat.astype({'bitscore':'float'})
-    dataframe_repeat = dataframe_repeat.loc[dataframe_repeat['bitscore'] >= bitscori_r]
-    forward_list = list(set(dataframe.loc[dataframe['sseqid'] == fname]['qseqid'].tolist()))
-    shared_list = list(set(dataframe.loc[(dataframe['sseqid'] == rname) & (dataframe['qseqid'].isin(forward_list))]['qseqid'].tolist())) # contigs which have results for both forward and reverse
-    repeat_list = list(set(dataframe_repeat.loc[dataframe_repeat['sseqid'] == 'VNTR63_01']['qseqid'].tolist()))
-    if len(shared_list) == 0: # This likely means that 1 of the primers wasn't found! Which is expected for 63_01 reverse
-        if fname != 'VNTR63_01_Ff':
-            print(f"Only 1 primer found for {fname}, can't continue")
-            return -2
-        else:
-            if len(forward_list) == 0:
-                print(f"Not even forward primer found for {fname}, can't continue")
-                return -2
-            else:
-                forward_pos1, forward_pos2 = [], []
-                for l in forward_list:
-                    forward_pos1_pre = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qend'].tolist()
-                    forward_pos2_pre = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qstart'].tolist()
-                    forward_pos1.extend(forward_pos1_pre)
-                    forward_pos2.extend(forward_pos2_pre)
-    else:
-        forward_pos1, forward_pos2 = [], []
-        for l in shared_list: # for every contig
-            forward_pos1_pre = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qend'].tolist()
-            forward_pos1.extend(forward_pos1_pre)
-            forward_pos2_pre = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qstart'].tolist()
-            forward_pos2.extend(forward_pos2_pre)
-    repeat_pos_list = []
-
-
-
-    for l in repeat_list:
-        repeat_pos = dataframe_repeat.loc[(dataframe_repeat['qseqid'] == l) & (dataframe_repeat['sseqid'] == 'VNTR63_01')].apply(lambda row: f"{row['qstart']}-{row['qend']}", axis=1).tolist()
-        repeat_pos_list.extend(repeat_pos)
-    repeat_sequence_in_range = determine_repeats_inrange(forward_pos1, forward_pos2, repeat_pos_list) # Only these make sense because they are in range with the forward primer
-    number_of_repeats = determine_chain(repeat_sequence_in_range)
-    return number_of_repeats
-
-def get_possible_sizes(dataframe, fname, rname, bitscori):
-    # TODO: Remove any possible sizes that are not within their found repeat locations.
-    forward_list = list(set(dataframe.loc[dataframe['sseqid'] == fname]['qseqid'].tolist()))
-    shared_list = list(set(dataframe.loc[(dataframe['sseqid'] == rname) & (dataframe['qseqid'].isin(forward_list))]['qseqid'].tolist())) # contigs which have results for both forward and reverse
-    all_posi_fc = []
-    dataframe = dataframe.astype({'bitscore':'float'})
-    dataframe = dataframe.loc[dataframe['bitscore'] >= bitscori]
-    for l in shared_list: # for every contig
-        forward_pos1 = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qend'].tolist()
-        reverse_pos1 = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == rname)]['qstart'].tolist()
-        forward_pos2 = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == fname)]['qstart'].tolist()
-        reverse_pos2 = dataframe.loc[(dataframe['qseqid'] == l) & (dataframe['sseqid'] == rname)]['qend'].tolist()
-        for f in forward_pos1: # Because I don't know the orientation of the chromosome the forward might actually be at a higher location than the reverse. So by subtracting reverse from forward you should have a positive integer <1200 whenever this happens.
-            for r in reverse_pos1: # Taking the qend of forward en qstart of reverse means you calculate the total size of the product whenever the forward is located upstream compared to the reverse.
-                if int(f)-int(r) >= 0 and int(f)-int(r) <= 1200:
-                    all_posi_fc.append(int(f)-int(r))
-        for f in forward_pos2:
-            for r in reverse_pos2:
-                if int(f)-int(r) >= -1200 and int(f)-int(r) <= 0:
-                    all_posi_fc.append(0-(int(f)-int(r)))
-    return list(set(all_posi_fc))
-
-
-
-def get_mlva_dict(dataframe):
-    MLVA_dict_fc = {}
-    MLVA_dict_fc['MLVA_MecA'] = get_possible_sizes(dataframe,'MLVA_MecA_Ff','MLVA_MecA_r',30)
-    MLVA_dict_fc['MLVA_MecA_LGA'] = get_possible_sizes(dataframe,'MLVA_MecA_LGA_Ff','MLVA_MecA_LGA_r',30)
-    MLVA_dict_fc['VNTR09_01'] = get_possible_sizes(dataframe,'VNTR09_01_Ff','VNTR09_01_r',30)
-    MLVA_dict_fc['VNTR61_01'] = get_possible_sizes(dataframe,'VNTR61_01_Nf','VNTR61_01_r',30)
-    MLVA_dict_fc['VNTR61_02'] = get_possible_sizes(dataframe,'VNTR61_02_Vf','VNTR61_02_r',30)
-    MLVA_dict_fc['VNTR67_01'] = get_possible_sizes(dataframe,'VNTR67_01_Pf','VNTR67_01_r',30)
-    MLVA_dict_fc['MLVA_PVL'] = get_possible_sizes(dataframe,'MLVA_PVL_Ff','MLVA_PVL_r',30)
-    MLVA_dict_fc['VNTR21_01'] = get_possible_sizes(dataframe,'VNTR21_01_Vf','VNTR21_01_r',30)
-    MLVA_dict_fc['VNTR24_01'] = get_possible_sizes(dataframe,'VNTR24_01_Pf','VNTR24_01_r',30)
-    MLVA_dict_fc['VNTR63_01'] = get_possible_sizes(dataframe,'VNTR63_01_Ff','VNTR63_01_r',15)
-    MLVA_dict_fc['VNTR81_01'] = get_possible_sizes(dataframe,'VNTR81_01_Nf','VNTR81_01_r',25)
-    return MLVA_dict_fc
-
-def mec_or_pvl(df_mappings, mecpvl_list, mlvadict):
+        forward = forward.loc[forward['qseqid'].isin(shared_list)]
+    repeats_per_contig = {contig: group for contig, group in dataframe_repeat.groupby('qseqid', observed=True)}
+    best = None
+    for contig, forward_contig in forward.groupby('qseqid', observed=True): # Repeats are only chained per contig, then the chain with the highest bitscore wins
+        if contig not in repeats_per_contig:
+            continue
+        repeats = repeats_per_contig[contig].drop_duplicates(['qstart', 'qend'])
+        in_range = determine_repeats_inrange(forward_contig['qend'].values, forward_contig['qstart'].values, repeats['qstart'].values, scheme.max_product_size)
+        if not in_range.any():
+            continue
+        chain = determine_chain(repeats['qstart'].values[in_range], repeats['qend'].values[in_range], repeats['bitscore'].values[in_range], locus)
+        if best is None or chain[1] > best[1]:
+            best = chain
+    if best is None:
+        return NO_BIN
+    return int(best[0])
+
+def get_all_possible_sizes(dataframe, scheme, with_support=False):
+    # All forward/reverse hit pairs on the same contig for all loci at once, instead of a scan of the whole table per contig and primer.
+    # Hits are matched to their locus, direction and bitscore cutoff by primer ID, contigs by their category code.
+    # Because I don't know the orientation of the chromosome the forward might actually be at a higher location than the reverse.
+    # Taking the qend of forward en qstart of reverse gives the product size whenever the forward is located downstream of the reverse,
+    # the qend of the reverse minus the qstart of the forward whenever it is upstream. Both have to be within max_product_size.
+    dataframe = typed_hits(dataframe)
+    primers = scheme.primer_ids(dataframe['sseqid'])
+    loci = np.where(primers != NOT_IN_SCHEME, scheme.primer_locus[primers], NOT_IN_SCHEME)
+    keep = (loci != NOT_IN_SCHEME) & (dataframe['bitscore'].values >= scheme.primer_min_bitscore[primers])
+    hits = pd.DataFrame({'contig': dataframe['qseqid'].cat.codes.values[keep], 'locus': loci[keep],
+                         'qstart': dataframe['qstart'].values[keep], 'qend': dataframe['qend'].values[keep],
+                         'bitscore': dataframe['bitscore'].values[keep]})
+    directions = scheme.primer_direction[primers[keep]]
+    pairs = hits.loc[directions == FORWARD].merge(hits.loc[directions == REVERSE], on=['contig', 'locus'], suffixes=('_f', '_r'))
+    downstream = pairs['qend_f'].values - pairs['qstart_r'].values
+    upstream = pairs['qend_r'].values - pairs['qstart_f'].values
+    keep_down = (downstream >= 0) & (downstream <= scheme.max_product_size)
+    keep_up = (upstream >= 0) & (upstream <= scheme.max_product_size)
+    pair_bitscore = pairs['bitscore_f'].values + pairs['bitscore_r'].values
+    sizes = pd.DataFrame({'locus': np.concatenate((pairs['locus'].values[keep_down], pairs['locus'].values[keep_up])),
+                          'size': np.concatenate((downstream[keep_down], upstream[keep_up])),
+                          'support': np.concatenate((pair_bitscore[keep_down], pair_bitscore[keep_up]))})
+    sizes = sizes.groupby(['locus', 'size'], as_index=False)['support'].max() # Best primer pair bitscore behind every size
+    sizes_per_locus = {locus: [] for locus in scheme.loci}
+    support_per_locus = {locus: {} for locus in scheme.loci}
+    for locus, group in sizes.groupby('locus'):
+        sizes_per_locus[scheme.loci[locus]] = group['size'].tolist()
+        support_per_locus[scheme.loci[locus]] = dict(zip(group['size'].tolist(), group['support'].tolist()))
+    if with_support:
+        return sizes_per_locus, support_per_locus
+    return sizes_per_locus
+
+def get_mlva_dict(dataframe, scheme):
+    return get_all_possible_sizes(dataframe, scheme)
+
+def mec_or_pvl(scheme, mlvadict): # Status of every marker of the scheme (MecA, PVL), by the bin of its product size
     mp_dict_fc = {}
-    for mp in mecpvl_list:
-        if mp == 'MLVA_MecA':
-            values = mlvadict[mp] + mlvadict[f"{mp}_LGA"]
-        else:
-            values = mlvadict[mp]
+    for marker in scheme.markers:
+        values = [size for locus in marker.loci for size in mlvadict[locus]] # MecA counts the sizes of the LGA primers too
         if len(values) == 0:
-            if mp == 'MLVA_MecA':
-                mp_dict_fc[mp] = "MecA MecC Negative"
-            elif mp == 'MLVA_PVL':
-                mp_dict_fc[mp] = "PVL Negative"
+            mp_dict_fc[marker.marker] = marker.absent
         elif len(set(values)) == 1:
-            try:
-                value = df_mappings.loc[(df_mappings['VNTR'] == mp) & (df_mappings['Start'] <= values[0]) & (df_mappings['Stop'] >= values[0])].Value.item()
-                if mp == 'MLVA_MecA':
-                    if value == 1:
-                        mp_dict_fc[mp] = "MecA Positive"
-                    elif value == 2:
-                        mp_dict_fc[mp] = "MecC Positive"
-                elif mp == 'MLVA_PVL':
-                    if value == 1:
-                        mp_dict_fc[mp] = "PVL Positive"
-            except:
-                mp_dict_fc[mp] = "Something failed"
+            value = scheme.bins.value(marker.marker, values[0])
+            if value == NO_BIN:
+                mp_dict_fc[marker.marker] = marker.failed
+            elif value in marker.values:
+                mp_dict_fc[marker.marker] = marker.values[value]
     return mp_dict_fc
 
-def get_my_profile(df_mappings, vntr_lst, mlvadict, df, df2):
-    profile_fc = "" 
-    profile_fc_list = []
-    deviated = False
-    for v in vntr_lst:
-        profile_fc = profile_fc.strip('-') # should just not add a '-' on the first value but this works too
-        if v == 'VNTR63_01': # Making an exception for VNTR63_01 because the reverse primer can't be found in about 30% of the isolates.
-            repeat_found = get_number_repeats(df,df2,'VNTR63_01_Ff','VNTR63_01_r',25,55)
-            profile_fc = f"{profile_fc}-{repeat_found}"
-        else:
-            values = mlvadict[v] # These values should be checked if they are within range of their primers!
-            if deviated == False:
-                if len(values) == 0:
-                    profile_fc = f"{profile_fc}-99"
-                elif len(values) == 1:
-                    try: # vntr_no = df_mappings.loc[(df_mappings['VNTR'] == v) & (df_mappings['Start'] <= values[0]) & (df_mappings['Stop'] >= values[0])].Value.item()
-                        matching_ranges = df_mappings.loc[
-                        (df_mappings['VNTR'] == v) & 
-                        (df_mappings['Start'] <= values[0]) & 
-                        (df_mappings['Stop'] >= values[0])]
-                        if not matching_ranges.empty:
-                            vntr_no = matching_ranges['Value'].item()
-                        else: # If the found size is outside a range it takes the closest value, perhaps should print a message for an isolate when this has happened.
-                            closest_value_index = np.argmin(
-                            np.abs(df_mappings.loc[df_mappings['VNTR'] == v, 'Start'].values - values[0]) +
-                            np.abs(df_mappings.loc[df_mappings['VNTR'] == v, 'Stop'].values - values[0]))
-                            vntr_no = df_mappings.loc[df_mappings['VNTR'] == v, 'Value'].iloc[closest_value_index]
-                        profile_fc = f"{profile_fc}-{vntr_no}"
-                    except:
-                        profile_fc = f"{profile_fc}-99"
-                else: # This means multiple locations have been found, however they might be in the same bin so this checks if that's the case or not.
-                    bin_list = []
-                    for index, val in enumerate(values):
-                        try:
-                            vntr_no = df_mappings.loc[(df_mappings['VNTR'] == v) & (df_mappings['Start'] <= val) & (df_mappings['Stop'] >= val)].Value.item()
-                            bin_list.append(vntr_no)
-                        except:
-                            bin_list.append('99')
-                        if index == len(values) - 1:
-                            if len(list(set(bin_list))) != 1:
-                                deviated = True
-                            else:
-                                profile_fc = f"{profile_fc}-{bin_list[0]}"
-                    if deviated == True:
-                        possibles = []
-                        for n in values:
-                            try:
-                                vntr_no = df_mappings.loc[(df_mappings['VNTR'] == v) & (df_mappings['Start'] <= n) & (df_mappings['Stop'] >= n)].Value.item()
-                                possibles.append(vntr_no)
-                            except:
-                                possibles.append('99')
-                        for p in possibles:
-                            profile_fc_list.append(f"{profile_fc}-{p}")
-            else: # This happens if deviates = True and multiple profiles were found, can probably be excluded because 
-                deviated_fc = determine_deviated_profiles(profile_fc_list, values, df_mappings, v)
-    if len(profile_fc_list) == 0: # This is done to not add a profile when multiples were found but can probably remove because it shouldn't happen. Besides how would we determine which one would be correct
-        profile_fc_list.append(profile_fc)
-    profile_fc_list = double_pad(list(set(profile_fc_list)))
-    return profile_fc_list
-
-
-
-
-
-def determine_deviated_profiles(a_profile_list, val, dfmap, fcv):
-    times_to_pop = len(a_profile_list)
-    for pli in range(0,len(a_profile_list)):
-        pl = a_profile_list[pli]
-        if len(val) == 0:
-            pl = f"{pl}-99"
-            a_profile_list.append(pl)
-        elif len(val) == 1:
-            try:
-                vntr_no = dfmap.loc[(dfmap['VNTR'] == fcv) & (dfmap['Start'] <= val[0]) & (dfmap['Stop'] >= val[0])].Value.item()
-                pl = f"{pl}-{vntr_no}"
-                successful = True
-            except:
-                pl = f"{pl}-99"
-                successful = False
-                a_profile_list.append(pl)
-            if successful:
-                a_profile_list.append(pl)
-        else:
-            possibles = []
-            for n in val:
-                try:
-                    vntr_no = dfmap.loc[(dfmap['VNTR'] == fcv) & (dfmap['Start'] <= n) & (dfmap['Stop'] >= n)].Value.item()
-                    possibles.append(vntr_no)
-                except:
-                    possibles.append('99')
-            for p in possibles:
-                a_profile_list.append(f"{pl}-{p}")
-    for p in range(0,times_to_pop):
-        a_profile_list.pop(0)
-    return a_profile_list
+def get_locus_candidates(scheme, mlvadict, df, df2, support=None, repeats=None):
+    # Every locus of the profile as a short list of (allele code, bitscore support) with the best supported code first
+    support = support or {}
+    repeats = repeats or {}
+    candidates = []
+    for v in scheme.profile_loci:
+        if v in scheme.counted: # The counted loci (VNTR63_01) get their number of repeats, not a bin of their product size
+            count = repeats[v] if v in repeats else get_number_repeats(df, df2, scheme, v)
+            candidates.append([(count, 0.0)])
+            continue
+        values = mlvadict[v] # These values should be checked if they are within range of their primers!
+        if len(values) == 0:
+            candidates.append([(NO_BIN, 0.0)])
+        elif len(values) == 1: # If the found size is outside a range it takes the closest value, perhaps should print a message for an isolate when this has happened.
+            candidates.append([(scheme.bins.value(v, values[0], nearest=True), support.get(v, {}).get(values[0], 0.0))])
+        else: # This means multiple locations have been found, however they might be in the same bin so this checks if that's the case or not.
+            codes = {}
+            for size, code in zip(values, scheme.bins.lookup(v, values).tolist()):
+                codes[code] = max(codes.get(code, 0.0), support.get(v, {}).get(size, 0.0))
+            candidates.append(sorted(codes.items(), key=lambda c: (-c[1], c[0])))
+    return candidates
+
+def expand_profiles(candidates, max_profiles=None):
+    # Lazily yields allele code combinations, best total support first (candidates of every locus sorted best first),
+    # without building the whole Cartesian product
+    start = (0,) * len(candidates)
+    score = lambda idx: sum(candidates[locus][i][1] for locus, i in enumerate(idx))
+    heap, seen, produced = [(-score(start), start)], {start}, 0
+    while heap and (max_profiles is None or produced < max_profiles):
+        negative_score, idx = heapq.heappop(heap)
+        yield [candidates[locus][i][0] for locus, i in enumerate(idx)]
+        produced += 1
+        for locus in range(len(idx)):
+            if idx[locus] + 1 < len(candidates[locus]):
+                following = idx[:locus] + (idx[locus] + 1,) + idx[locus + 1:]
+                if following not in seen:
+                    seen.add(following)
+                    heapq.heappush(heap, (-score(following), following))
+
+def format_profile(codes):
+    return double_pad(['-'.join(str(c) for c in codes)])[0]
+
+def get_my_profile(scheme, mlvadict, df, df2, support=None, max_profiles=MAX_PROFILES, repeats=None):
+    candidates = get_locus_candidates(scheme, mlvadict, df, df2, support, repeats)
+    return [format_profile(codes) for codes in expand_profiles(candidates, max_profiles)]
 
 def double_pad(profile_lst):
     double_padded_lst_fc = []
@@ -340,49 +321,130 @@ def double_pad(profile_lst):
         double_padded_lst_fc.append(new_l_fc)
     return double_padded_lst_fc
 
-def write_to_file(profile_lst, df_mappings, mecpvl_list, mlvadict, fname, outd):
-    base_input_fc = os.path.basename(fname[0]).replace('_primers-blastn.csv','')
-    with open(f"{outd}/{base_input_fc}_MLVA.txt", "w") as my_file:
+def write_to_file(profile_lst, scheme, mlvadict, basename, outd, output_mecpvl=None):
+    if output_mecpvl is None:
+        output_mecpvl = mec_or_pvl(scheme,mlvadict) # Same for every profile of the isolate
+    with open(f"{outd}/{basename}_MLVA.txt", "w") as my_file:
         # my_file.write(str(profile_lst) + '\n')
         for p in profile_lst:
-            output_mecpvl = mec_or_pvl(df_mappings,mecpvl_list,mlvadict)
             my_file.write(f"MLVA profile: {p}" + '\n')
-            my_file.write(output_mecpvl['MLVA_MecA'] + '\n')
-            my_file.write(output_mecpvl['MLVA_PVL'] + '\n')
-
-
+            for marker in scheme.markers:
+                my_file.write(output_mecpvl.get(marker.marker, '') + '\n')
+
+
+def summary_rows(basename, profile_lst, output_mecpvl, mlvadict, scheme): # One row per isolate and profile for the summary table
+    sizes = {locus: ';'.join(str(size) for size in mlvadict[locus]) for locus in scheme.loci}
+    markers = {marker.column: output_mecpvl.get(marker.marker, '') for marker in scheme.markers}
+    return [dict(isolate=basename, profile_rank=rank + 1, profile=p, **markers, **sizes) for rank, p in enumerate(profile_lst)]
+
+def write_summary(rows, outd, scheme): # All isolates in one table instead of a small file per isolate
+    columns = ['isolate', 'profile_rank', 'profile'] + [marker.column for marker in scheme.markers] + list(scheme.loci)
+    summary = pd.DataFrame(rows, columns=columns).sort_values(['isolate', 'profile_rank'])
+    summary.to_csv(f"{outd}/mlva_summary.tsv", sep='\t', index=False)
+    try:
+        summary.to_parquet(f"{outd}/mlva_summary.parquet", index=False)
+    except ImportError:
+        print("pyarrow is not installed, only writing mlva_summary.tsv")
+    print(f"Summary of {summary['isolate'].nunique()} isolates: {outd}/mlva_summary.tsv")
+
+def blast_running(pid): # A process that exited but was not reaped yet (a zombie) has stopped as well
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+def wait_for_blast(list_of_files, blastdir, timeout, metrics=NO_METRICS, blast_pid=None, missing=None): # Yields every input file once the marker for its blast output shows up
+    # Isolates whose output never shows up, because of the timeout or because blast_pid stopped first, are added to missing
+    pending = {f"{blastdir}/{isolate_name(f)}": f for f in list_of_files}
+    start = time.time()
+    deadline = start + timeout
+    while len(pending) > 0:
+        stopped = blast_pid is not None and not blast_running(blast_pid) # Checked before the markers, so markers written just before exiting are seen
+        for outputname in list(pending):
+            if os.path.exists(marker_path(outputname, True)):
+                metrics.record(os.path.basename(outputname), 'wait', wall_s=round(time.time() - start, 3))
+                yield pending.pop(outputname)
+            elif os.path.exists(marker_path(outputname, False)):
+                print(f"blastn failed for {pending.pop(outputname)}, skipping")
+        if len(pending) > 0:
+            if stopped:
+                print(f"blast_mrsa_mlva.py (PID {blast_pid}) stopped without blast output for {len(pending)} isolates")
+            elif time.time() > deadline:
+                print(f"Timed out waiting for blast output of {len(pending)} isolates")
+            else:
+                time.sleep(1)
+                continue
+            if missing is not None:
+                missing.extend(pending.values())
+            return
+
+def type_hits(primer_hits, repeat_hits, scheme, max_profiles=MAX_PROFILES, metrics=NO_METRICS, isolate=None):
+    # Hits as typed tables (read_hits) or as rows of the 12 blastn columns as strings, straight from the search
+    with metrics.stage(isolate, 'parse_hits', primer_hits=len(primer_hits), repeat_hits=len(repeat_hits)):
+        df = typed_hits(primer_hits) if isinstance(primer_hits, pd.DataFrame) else hits_frame(primer_hits) # The blast primer output to a df
+        df2 = typed_hits(repeat_hits) if isinstance(repeat_hits, pd.DataFrame) else hits_frame(repeat_hits) # The blast repeat output to a df
+    with metrics.stage(isolate, 'sizes') as counts:
+        MLVA_dict, support = get_all_possible_sizes(df, scheme, with_support=True)
+        counts['sizes'] = sum(len(sizes) for sizes in MLVA_dict.values())
+    with metrics.stage(isolate, 'repeats'):
+        repeats = {locus: get_number_repeats(df, df2, scheme, locus) for locus in scheme.counted}
+    with metrics.stage(isolate, 'bins') as counts:
+        profiles_in_a_list = get_my_profile(scheme, MLVA_dict, df, df2, support, max_profiles, repeats)
+        counts['profiles'] = len(profiles_in_a_list)
+    return profiles_in_a_list, MLVA_dict
+
+def type_isolate(file, blastdir, outdir, scheme, max_profiles=MAX_PROFILES, write_txt=True, metrics=NO_METRICS):
+    basename = isolate_name(file)
+    outputname = f"{blastdir}/{basename}"
+    with metrics.stage(basename, 'isolate'):
+        with metrics.stage(basename, 'load_hits'): # csv, npz or feather, whichever blast_mrsa_mlva.py wrote
+            primer_hits, repeat_hits = read_hits(find_hits(outputname, 'primers')), read_hits(find_hits(outputname, 'repeat'))
+        profiles_in_a_list, MLVA_dict = type_hits(primer_hits, repeat_hits, scheme, max_profiles, metrics, basename)
+        in_silico_profile = profiles_in_a_list[0]
+        with metrics.stage(basename, 'write'):
+            output_mecpvl = mec_or_pvl(scheme,MLVA_dict)
+            if write_txt:
+                write_to_file(profiles_in_a_list,scheme,MLVA_dict,basename,outdir,output_mecpvl)
+    print(f"profile for {file}: {in_silico_profile}")
+    return summary_rows(basename, profiles_in_a_list, output_mecpvl, MLVA_dict, scheme)
 
+def type_isolate_in_worker(file, blastdir, outdir, scheme_file, max_profiles, write_txt, metrics, profile):
+    return profiled(profile, True, type_isolate, file, blastdir, outdir, load_scheme(scheme_file), max_profiles, write_txt, metrics)
 
 def main():
     current_file_path = os.path.abspath(__file__)
     parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
-    mrsa_mapping = os.path.join(parent_dir_path, "files", "mrsa_mappings.csv")
     logo_path = os.path.join(parent_dir_path, "files", "logo.txt")
-    df_mapping = pd.read_csv(mrsa_mapping, sep=",")
 
     flags = parse_arguments(getmylogo(logo_path))
+    scheme = load_scheme(flags.scheme) # Compiled once, before the workers start, so they share it instead of compiling it again
     outdir = determine_outdir(flags.output)
-    blastn_header = ['qseqid','sseqid','pident','length','mismatch','gapopen','qstart','qend','sstart','send','evalue','bitscore']
-    static_list = ['MLVA_MecA', 'MLVA_PVL']
-    vntr_list = ['VNTR09_01', 'VNTR61_01', 'VNTR61_02', 'VNTR67_01', 'VNTR21_01', 'VNTR24_01', 'VNTR63_01', 'VNTR81_01']
-    list_of_files = glob.glob(os.path.abspath(f"{flags.input}/*"))
-    for file in list_of_files:
-        
-        basename = os.path.splitext(os.path.basename(file))[0]
-        parent_dir_path_out = os.path.dirname(outdir)
-        outputname = f"{parent_dir_path_out}/blastn/{basename}"
-        blast_input = [f"{outputname}_primers-blastn.csv"]
-        repeat_file = [f"{outputname}_repeat-blastn.csv"]
-        single_entry_list_primers = [entry for file in (csv_to_list(f) for f in blast_input) if file for entry in file]
-        single_entry_list_repeats = [entry for file in (csv_to_list(f) for f in repeat_file) if file for entry in file]
-        df = pd.DataFrame(single_entry_list_primers, columns=blastn_header) # The blast primer output to a df
-        df2 = pd.DataFrame(single_entry_list_repeats, columns=blastn_header) # The blast repeat output to a df
-        MLVA_dict = get_mlva_dict(df)
-
-        profiles_in_a_list = get_my_profile(df_mapping, vntr_list, MLVA_dict, df, df2)
-        in_silico_profile = profiles_in_a_list[0]
-        write_to_file(profiles_in_a_list,df_mapping,static_list,MLVA_dict,blast_input,outdir)
-        print(f"profile for {file}: {in_silico_profile}")
+    list_of_files = discover_inputs(flags.input, f"{os.path.dirname(outdir)}/input", write=False, multi_isolate=flags.multi_isolate) # blast_mrsa_mlva.py splits a multi-isolate fasta
+    blastdir = f"{os.path.dirname(outdir)}/blastn"
+    metrics = Metrics(flags.metrics)
+    missing = []
+    if flags.wait is not None:
+        list_of_files = wait_for_blast(list_of_files, blastdir, flags.wait, metrics, flags.blast_pid, missing)
+    rows = []
+    if flags.workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=flags.workers) as pool:
+            futures = [pool.submit(type_isolate_in_worker, file, blastdir, outdir, flags.scheme, flags.max_profiles, not flags.no_txt, metrics, flags.profile) for file in list_of_files]
+            for future in concurrent.futures.as_completed(futures):
+                rows.extend(future.result())
+    else:
+        for file in list_of_files:
+            rows.extend(profiled(flags.profile, False, type_isolate, file, blastdir, outdir, scheme, flags.max_profiles, not flags.no_txt, metrics))
+    with metrics.stage(None, 'summary', isolates=len({row['isolate'] for row in rows})):
+        write_summary(rows, outdir, scheme)
+    if len(missing) > 0:
+        sys.exit(f"No blast output for {len(missing)} isolates, they are not in the summary")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,15 @@
+import importlib.util, sys
+
+# pandas and numpy take most of the start up time of every script, while --help, waiting for blast or submitting jobs
+# doesn't need them. A lazy module is only really imported when one of its attributes is used for the first time.
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
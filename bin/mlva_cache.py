@@ -0,0 +1,100 @@
+import hashlib, json, os, shutil, tempfile, time
+
+# Results are stored under a hash of everything they depend on: the assembly, the reference files, the search settings
+# and the version of this pipeline. An unchanged isolate is served from the cache, anything that changed gets a new key.
+
+VERSION = "iMLVA v0.1" # Part of every key, so results of an older version are never reused
+
+def file_digest(pth):
+    digest = hashlib.sha256()
+    with open(pth, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache(object):
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size # in bytes, None keeps everything
+        self._digests = {} # The reference files are the same for every isolate, hash them only once
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, files, **params):
+        digest = hashlib.sha256(VERSION.encode())
+        for pth in files:
+            if pth not in self._digests:
+                self._digests[pth] = file_digest(pth)
+            digest.update(self._digests[pth].encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, targets): # Copies the cached files to their targets, False if not (completely) cached
+        entry = self.entry(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in targets):
+            return False
+        for name, target in targets.items():
+            shutil.copyfile(os.path.join(entry, name), target)
+        os.utime(entry) # Recently used entries are evicted last
+        return True
+
+    def put(self, key, sources):
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry)) # Other processes only ever see complete entries
+        for name, source in sources.items():
+            shutil.copyfile(source, os.path.join(tmp, name))
+        try:
+            os.rename(tmp, entry)
+        except OSError: # Stored by another process in the meantime
+            shutil.rmtree(tmp)
+
+    def get_rows(self, key):
+        entry = self.entry(key)
+        if not os.path.exists(os.path.join(entry, 'rows.json')):
+            return None
+        with open(os.path.join(entry, 'rows.json')) as f:
+            rows = json.load(f)
+        os.utime(entry)
+        return rows
+
+    def put_rows(self, key, rows, sources):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(rows, f)
+        try:
+            self.put(key, dict(sources, **{'rows.json': f.name}))
+        finally:
+            os.remove(f.name)
+
+    def evict(self): # Removes the least recently used entries until the cache fits in max_size
+        if self.max_size is None:
+            return []
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            if not os.path.isdir(os.path.join(self.cache_dir, prefix)): # Compiled schemes (scheme_*.pickle) are kept
+                continue
+            for key in os.listdir(os.path.join(self.cache_dir, prefix)):
+                entry = os.path.join(self.cache_dir, prefix, key)
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, key, entry))
+        total = sum(size for mtime, size, key, entry in entries)
+        evicted = []
+        for mtime, size, key, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
+
+def write_manifest(manifest, pth): # Which isolates were served from the cache in this run
+    with open(pth, 'w') as f:
+        f.write("isolate\tkey\tstatus\trun\n")
+        run = time.strftime('%Y-%m-%dT%H:%M:%S')
+        for isolate, key, status in sorted(manifest):
+            f.write(f"{isolate}\t{key}\t{status}\t{run}\n")
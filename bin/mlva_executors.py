@@ -0,0 +1,268 @@
+import abc, concurrent.futures, json, math, os, re, shlex, subprocess, sys, time
+
+# Executors run the search commands of every isolate and report back per isolate once all of its
+# commands have finished, so downstream typing never has to guess (or sleep) until output exists.
+# The array executors pack several isolates into every task of one job array instead of running a job per command.
+
+ARRAY_LIMIT = 1000 # Most tasks in one LSF job array (MAX_JOB_ARRAY_SIZE)
+TASK_MEMORY_MB = 1024 # Memory of a task: a base plus an amount per MB of its largest assembly
+MEMORY_PER_MB = 64
+TASK_MINUTES = 5 # Run time of a task: a base plus an amount per MB of all its assemblies
+MINUTES_PER_MB = 0.5
+ARRAY_TIMEOUT = 24 * 60 * 60 # Seconds the array executors wait for all tasks, the isolates of unfinished tasks fail after that
+
+def run_command(cmd):
+    try:
+        completed = subprocess.run(cmd, stdout=subprocess.DEVNULL)
+    except OSError as e: # binary not found, not executable, etc.
+        print(f"Could not run {cmd[0]}: {e}")
+        return 127
+    return completed.returncode
+
+class LocalExecutor(object):
+    name = 'local'
+
+    def __init__(self, workers=None, threads=1, **settings): # settings of the array executors are not used
+        self.threads = threads
+        if workers is None: # Fill the machine, but don't oversubscribe cores when blastn runs multithreaded
+            workers = max(1, (os.cpu_count() or 1) // max(1, threads))
+        self.workers = workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers) # every worker waits on one child process
+        self._futures = {}
+        self._remaining = {}
+        self._failed = {}
+
+    def wrap(self, cmd):
+        return cmd
+
+    def submit(self, group, cmd, size=0): # size (bytes of input) only matters to the array executors
+        future = self._pool.submit(run_command, self.wrap(cmd))
+        self._futures[future] = group
+        self._remaining[group] = self._remaining.get(group, 0) + 1
+        self._failed.setdefault(group, False)
+        return future
+
+    def flush(self): # Commands are running from the moment they are submitted
+        pass
+
+    def as_completed(self): # Yields (group, success) as soon as all commands of a group are done
+        for future in concurrent.futures.as_completed(list(self._futures)):
+            group = self._futures.pop(future)
+            if future.result() != 0:
+                self._failed[group] = True
+            self._remaining[group] -= 1
+            if self._remaining[group] == 0:
+                del self._remaining[group]
+                yield group, not self._failed.pop(group)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+class LsfExecutor(LocalExecutor):
+    name = 'lsf'
+
+    def __init__(self, workers=None, threads=1, queue='bio', **settings):
+        if workers is None: # Number of bsub -K calls kept open at the same time, the cluster does the actual work
+            workers = 200
+        super().__init__(workers, threads)
+        self.queue = queue
+
+    def wrap(self, cmd): # bsub -K blocks until the job has finished and returns its exit code
+        return ['bsub', '-K', '-q', self.queue, '-n', str(self.threads),
+                '-R', 'rusage[mem=12G]', '-R', 'span[hosts=1]', '-W', '15', '-M', '16000',
+                ' '.join(shlex.quote(c) for c in cmd)]
+
+def task_resources(sizes, isolates_per_task, threads): # Memory (MB) and run time (minutes) of the largest task, from the assembly sizes
+    mb = sorted((size / 1e6 for size in sizes), reverse=True) or [0]
+    memory = TASK_MEMORY_MB + MEMORY_PER_MB * math.ceil(mb[0])
+    minutes = TASK_MINUTES + MINUTES_PER_MB * sum(mb[:isolates_per_task]) / max(1, threads)
+    return dict(memory_mb=int(math.ceil(memory / 256) * 256), minutes=int(math.ceil(minutes)))
+
+def task_marker(workdir, task):
+    return os.path.join(workdir, f"task_{task}.done")
+
+def write_task_marker(workdir, task, results): # Renamed when complete, the submitting process never reads half a marker
+    marker = task_marker(workdir, task)
+    with open(f"{marker}.tmp", 'w') as f:
+        json.dump(results, f)
+    os.replace(f"{marker}.tmp", marker)
+
+class ArrayExecutor(abc.ABC):
+    # Collects the commands of every group (isolate), packs isolates_per_task groups into every task and submits all tasks
+    # at once on flush. Every task runs its commands one after the other (python mlva_executors.py manifest.json) and
+    # writes a marker with the result of each of its groups, which as_completed picks up.
+    name = None
+    poll = 1 # Seconds between looking for task markers
+
+    def __init__(self, workers=None, threads=1, isolates_per_task=10, workdir='array', timeout=ARRAY_TIMEOUT, **settings):
+        self.workers, self.threads, self.isolates_per_task, self.workdir = workers, threads, isolates_per_task, os.path.abspath(workdir)
+        self.timeout = timeout
+        self._groups = {} # group: ([commands], bytes of input)
+        self._tasks = None
+
+    def submit(self, group, cmd, size=0):
+        commands, previous = self._groups.get(group, ([], 0))
+        self._groups[group] = (commands + [cmd], max(previous, size))
+
+    def flush(self):
+        if self._tasks is not None:
+            return
+        groups = list(self._groups)
+        self._tasks = {task + 1: groups[start:start + self.isolates_per_task] # Task numbers start at 1, like LSB_JOBINDEX
+                       for task, start in enumerate(range(0, len(groups), self.isolates_per_task))}
+        if len(self._tasks) == 0:
+            return
+        os.makedirs(self.workdir, exist_ok=True)
+        for task in self._tasks:
+            if os.path.exists(task_marker(self.workdir, task)): # Left over from a previous run
+                os.remove(task_marker(self.workdir, task))
+        resources = task_resources([size for commands, size in self._groups.values()], self.isolates_per_task, self.threads)
+        manifest = os.path.join(self.workdir, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump(dict(resources=resources, tasks={task: [[group, self._groups[group][0]] for group in groups]
+                                                       for task, groups in self._tasks.items()}), f)
+        self.launch([sys.executable, os.path.abspath(__file__), manifest], len(self._tasks), resources)
+
+    @abc.abstractmethod
+    def launch(self, cmd, tasks, resources): # Starts cmd once for every task number 1..tasks, in LSB_JOBINDEX (plus an offset argument)
+        pass
+
+    @abc.abstractmethod
+    def task_failed(self, task): # True once a task has stopped without writing its marker
+        pass
+
+    def cancel(self, tasks): # Stops the tasks that are still queued or running after the timeout
+        pass
+
+    def fail_tasks(self, tasks): # Tasks that could not be started get a marker in which all their groups failed
+        for task in tasks:
+            write_task_marker(self.workdir, task, {group: False for group in self._tasks[task]})
+
+    def as_completed(self):
+        self.flush()
+        pending = dict(self._tasks)
+        deadline = time.time() + self.timeout
+        while len(pending) > 0:
+            for task in list(pending):
+                marker = task_marker(self.workdir, task)
+                if os.path.exists(marker):
+                    with open(marker) as f:
+                        results = json.load(f)
+                    for group in pending.pop(task):
+                        yield group, results.get(group, False)
+                elif self.task_failed(task):
+                    print(f"Task {task} of the job array stopped without finishing, {len(pending[task])} isolates failed")
+                    for group in pending.pop(task):
+                        yield group, False
+            if len(pending) > 0 and time.time() > deadline:
+                print(f"{len(pending)} tasks of the job array did not finish within {self.timeout} seconds, their isolates failed")
+                self.cancel(list(pending))
+                for task in list(pending):
+                    for group in pending.pop(task):
+                        yield group, False
+            if len(pending) > 0:
+                time.sleep(self.poll)
+
+    def shutdown(self):
+        pass
+
+class LocalArrayExecutor(ArrayExecutor):
+    # Stand-in for the cluster scheduler: runs the tasks of the job array on this machine, workers tasks at a time
+    name = 'local_array'
+
+    def launch(self, cmd, tasks, resources):
+        if self.workers is None:
+            self.workers = max(1, (os.cpu_count() or 1) // max(1, self.threads))
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self._running = {task: self._pool.submit(subprocess.run, cmd, env=dict(os.environ, LSB_JOBINDEX=str(task))) for task in range(1, tasks + 1)}
+
+    def task_failed(self, task):
+        return self._running[task].done() and not os.path.exists(task_marker(self.workdir, task))
+
+    def shutdown(self):
+        if self._tasks: # Nothing was launched without tasks
+            self._pool.shutdown(wait=True)
+
+class LsfArrayExecutor(ArrayExecutor):
+    name = 'lsf_array'
+    check_every = 30 # Seconds between asking bjobs for tasks that ended without a marker
+    ended_states = (['DONE'], ['EXIT'])
+
+    def __init__(self, workers=None, threads=1, queue='bio', **settings):
+        super().__init__(workers, threads, **settings)
+        self.queue = queue
+        self._jobs, self._ended, self._failed, self._checked = [], set(), set(), 0
+
+    def launch(self, cmd, tasks, resources):
+        logs = os.path.join(self.workdir, 'logs')
+        os.makedirs(logs, exist_ok=True)
+        name = f"mlva_{os.getpid()}"
+        for offset in range(0, tasks, ARRAY_LIMIT): # Array indices can't go over the limit either, later arrays add an offset
+            last = min(tasks - offset, ARRAY_LIMIT)
+            try:
+                submitted = subprocess.run(['bsub', '-J', f"{name}[1-{last}]", '-q', self.queue, '-n', str(self.threads),
+                                            '-R', f"rusage[mem={resources['memory_mb']}M]", '-R', 'span[hosts=1]',
+                                            '-M', str(resources['memory_mb'] * 5 // 4), '-W', str(resources['minutes']),
+                                            '-o', os.path.join(logs, '%J_%I.log'), ' '.join(shlex.quote(c) for c in cmd + [str(offset)])],
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                job = re.search(r'Job <(\d+)>', submitted.stdout) if submitted.returncode == 0 else None
+                error = submitted.stderr.strip() or f"exit status {submitted.returncode}"
+            except OSError as e: # bsub not found, not executable, etc.
+                job, error = None, str(e)
+            if job is None:
+                print(f"Could not submit tasks {offset + 1}-{offset + last} of the job array: {error}")
+                self.fail_tasks(range(offset + 1, offset + last + 1))
+                continue
+            self._jobs.append((job.group(1), offset, last))
+
+    def task_failed(self, task):
+        if time.time() - self._checked > self.check_every:
+            self._checked, ended = time.time(), set()
+            for job, offset, last in self._jobs:
+                status = subprocess.run(['bjobs', '-noheader', '-o', 'jobindex stat', job], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                if 'not found' in status.stderr: # Unknown to LSF, or ended so long ago that it was cleaned from the history
+                    ended.update(range(offset + 1, offset + last + 1))
+                else:
+                    ended.update(int(line.split()[0]) + offset for line in status.stdout.splitlines() if line.split()[1:] in self.ended_states)
+            self._ended, previous = ended, self._ended
+            self._failed = previous & ended # Ended two checks in a row without a marker, not just a slow file system
+        return task in self._failed and not os.path.exists(task_marker(self.workdir, task))
+
+    def cancel(self, tasks):
+        for job, offset, last in self._jobs:
+            indices = [str(task - offset) for task in tasks if offset < task <= offset + last]
+            if len(indices) > 0:
+                subprocess.run(['bkill', f"{job}[{','.join(indices)}]"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+EXECUTORS = {
+    LocalExecutor.name: LocalExecutor,
+    LsfExecutor.name: LsfExecutor,
+    LocalArrayExecutor.name: LocalArrayExecutor,
+    LsfArrayExecutor.name: LsfArrayExecutor,
+}
+
+def get_executor(name, workers=None, threads=1, **settings):
+    return EXECUTORS[name](workers=workers, threads=threads, **settings)
+
+def run_task(manifest, task): # One task of a job array: the commands of all its groups, then the marker with their results
+    with open(manifest) as f:
+        groups = json.load(f)['tasks'][str(task)]
+    results = {}
+    for group, commands in groups:
+        results[group] = all(run_command(cmd) == 0 for cmd in commands) # The commands after a failure are skipped
+    write_task_marker(os.path.dirname(manifest), task, results)
+
+def marker_path(outputname, success=True):
+    return f"{outputname}.done" if success else f"{outputname}.failed"
+
+def clear_markers(outputname):
+    for success in (True, False):
+        if os.path.exists(marker_path(outputname, success)):
+            os.remove(marker_path(outputname, success))
+
+def write_marker(outputname, success):
+    with open(marker_path(outputname, success), 'w'):
+        pass
+
+if __name__ == "__main__": # Run by every task of a job array
+    run_task(sys.argv[1], int(os.environ['LSB_JOBINDEX']) + (int(sys.argv[2]) if len(sys.argv) > 2 else 0))
@@ -0,0 +1,72 @@
+import os
+from lazy_imports import lazy_import
+
+# Typed hit tables: the 12 blastn columns with integer coordinates, float scores and the contig and primer names as
+# categories, read in one go by the C parser of pandas instead of as lists of strings. Besides the blastn csv files the hits
+# can be stored as .npz (numpy only) or .feather (needs pyarrow), which load without any parsing.
+
+BLASTN_HEADER = ['qseqid','sseqid','pident','length','mismatch','gapopen','qstart','qend','sstart','send','evalue','bitscore']
+HIT_DTYPES = {'qseqid': 'category', 'sseqid': 'category', 'pident': 'float32', 'length': 'int32', 'mismatch': 'int32',
+              'gapopen': 'int32', 'qstart': 'int32', 'qend': 'int32', 'sstart': 'int32', 'send': 'int32',
+              'evalue': 'float64', 'bitscore': 'float64'}
+HIT_FORMATS = ['csv', 'npz', 'feather']
+CATEGORIES = '.categories' # npz key of the names behind the codes of a categorical column
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+def typed_hits(dataframe): # Casts only the columns that don't have their hit type yet, typed tables are returned as they are
+    casts = {column: dtype for column, dtype in HIT_DTYPES.items() if column in dataframe and str(dataframe[column].dtype) != dtype}
+    return dataframe.astype(casts) if casts else dataframe
+
+def hits_frame(rows): # Rows of 12 strings, straight from a search, as a typed table
+    return typed_hits(pd.DataFrame(list(rows), columns=BLASTN_HEADER))
+
+def hit_path(outputname, search, hit_format='csv'): # search is primers or repeat
+    return f"{outputname}_{search}-blastn.{hit_format}"
+
+def find_hits(outputname, search): # The stored hits in whichever format blast_mrsa_mlva.py wrote, the csv file when there are none
+    found = [hit_path(outputname, search, hit_format) for hit_format in HIT_FORMATS if os.path.exists(hit_path(outputname, search, hit_format))]
+    if len(found) > 1: # blast_mrsa_mlva.py removes the hits of earlier runs, so which of these is current can't be told
+        raise ValueError(f"Hits of {os.path.basename(outputname)} are stored as {', '.join(os.path.basename(pth) for pth in found)}, search it again")
+    return found[0] if len(found) > 0 else hit_path(outputname, search)
+
+def clear_hits(outputname): # Hits of an earlier run, in any format, so they are never typed instead of the new ones
+    for search in ('primers', 'repeat'):
+        for hit_format in HIT_FORMATS:
+            if os.path.exists(hit_path(outputname, search, hit_format)):
+                os.remove(hit_path(outputname, search, hit_format))
+
+def read_hits(pth):
+    if pth.endswith('.npz'):
+        with np.load(pth, allow_pickle=False) as data:
+            return pd.DataFrame({column: pd.Categorical.from_codes(data[column], data[column + CATEGORIES]) if dtype == 'category' else data[column]
+                                 for column, dtype in HIT_DTYPES.items()})
+    if pth.endswith('.feather'):
+        return typed_hits(pd.read_feather(pth))
+    if os.path.getsize(pth) == 0: # blastn writes an empty file when nothing is found
+        return hits_frame([])
+    return pd.read_csv(pth, header=None, names=BLASTN_HEADER, dtype=HIT_DTYPES)
+
+def write_hits(hits, pth):
+    hits = typed_hits(hits).reset_index(drop=True)
+    if pth.endswith('.npz'):
+        arrays = {}
+        for column, dtype in HIT_DTYPES.items():
+            if dtype == 'category':
+                arrays[column] = hits[column].cat.codes.values
+                arrays[column + CATEGORIES] = np.asarray(hits[column].cat.categories, dtype=str)
+            else:
+                arrays[column] = hits[column].values
+        with open(pth, 'wb') as f: # np.savez adds .npz to a path, not to an open file
+            np.savez(f, **arrays)
+    elif pth.endswith('.feather'):
+        hits.to_feather(pth)
+    else:
+        hits.to_csv(pth, header=False, index=False)
+
+def convert_hits(outputname, hit_format): # Replaces the blastn csv files of an isolate by hit_format
+    if hit_format == 'csv':
+        return
+    for search in ('primers', 'repeat'):
+        write_hits(read_hits(hit_path(outputname, search)), hit_path(outputname, search, hit_format))
+        os.remove(hit_path(outputname, search))
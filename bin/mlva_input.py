@@ -0,0 +1,180 @@
+import glob, gzip, mmap, os, shlex, shutil, subprocess, sys, tempfile
+
+# Finds the assemblies to type: every fasta file in a directory (plain, gzip, bgzip or zstd compressed), the isolates of one
+# multi-isolate fasta file (headers like >isolate|contig, only when asked for, a | is common in ordinary headers such as
+# >gnl|contig_1) or a list of files / fasta text on stdin. Compressed files are
+# decompressed in memory or piped into blastn, never written out uncompressed.
+
+COMPRESSION = {'.gz': 'gzip', '.bgz': 'gzip', '.zst': 'zstd'}
+DECOMPRESS = {'gzip': ['gzip', '-dc'], 'zstd': ['zstd', '-dcq']}
+ISOLATE_SEPARATOR = '|' # Isolate name and contig name in the headers of a multi-isolate fasta
+MMAP_SIZE = 64 * 1024 * 1024 # Uncompressed files from this size on are parsed from a memory map instead of read in one go
+
+def compression(pth):
+    return COMPRESSION.get(os.path.splitext(pth)[1].lower())
+
+def isolate_name(pth): # RIVM_M096462.fasta.gz -> RIVM_M096462
+    name = os.path.basename(pth)
+    if compression(name) is not None:
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+class DecompressPipe(object): # Output of a decompression command, its exit status is checked once all of it has been read
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        self.eof = False
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        self.eof = self.eof or size is None or size < 0 or len(data) == 0
+        return data
+
+    def __iter__(self):
+        for line in self.process.stdout:
+            yield line
+        self.eof = True
+
+    def close(self):
+        self.process.stdout.close()
+        if not self.eof: # Stopped reading early (is_fasta only reads the start), its exit status says nothing
+            self.process.kill()
+        returncode = self.process.wait()
+        if self.eof and returncode != 0:
+            raise OSError(f"{' '.join(self.cmd)} exited with {returncode}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_binary(pth):
+    if pth == '-':
+        return sys.stdin.buffer
+    method = compression(pth)
+    if method == 'gzip': # bgzip files are gzip files with several members
+        return gzip.open(pth, 'rb')
+    if method == 'zstd':
+        try:
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(open(pth, 'rb'))
+        except ImportError: # Without the python package the zstd command decompresses into a pipe
+            if shutil.which('zstd') is None:
+                raise SystemExit(f"Reading {pth} needs the zstandard package (pip install zstandard) or the zstd command")
+            return DecompressPipe(DECOMPRESS['zstd'] + [pth])
+    return open(pth, 'rb')
+
+def is_fasta(pth): # The first character that is not whitespace is a >
+    try:
+        with open_binary(pth) as f:
+            return f.read(1024).lstrip()[:1] == b'>'
+    except (OSError, EOFError): # Directories, unreadable or broken compressed files
+        return False
+
+def parse_records(data): # [(name, sequence)] of fasta bytes, a memory map works as well
+    records = []
+    pos = data.find(b'>')
+    while pos != -1:
+        newline = data.find(b'\n', pos)
+        if newline == -1:
+            newline = len(data)
+        following = data.find(b'\n>', newline)
+        end = len(data) if following == -1 else following
+        header = data[pos + 1:newline].decode().split()
+        seq = data[newline + 1:end].replace(b'\n', b'').replace(b'\r', b'').decode()
+        records.append((header[0] if header else '', seq))
+        pos = -1 if following == -1 else following + 1
+    return records
+
+def read_records(pth):
+    if pth != '-' and compression(pth) is None and os.path.getsize(pth) >= MMAP_SIZE:
+        with open(pth, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_records(data)
+    with open_binary(pth) as f:
+        return parse_records(f.read())
+
+def without_isolate(names): # Every header of a multi-isolate fasta needs an isolate name, no contig is silently left out
+    if len(names) > 0:
+        raise ValueError(f"{len(names)} headers have no isolate name before '{ISOLATE_SEPARATOR}', for example >{names[0]}")
+
+def split_isolates(records): # {isolate: [(contig, sequence)]} in input order
+    without_isolate([name for name, seq in records if ISOLATE_SEPARATOR not in name])
+    isolates = {}
+    for name, seq in records:
+        isolate, contig = name.split(ISOLATE_SEPARATOR, 1)
+        isolates.setdefault(isolate, []).append((contig, seq))
+    return isolates
+
+def header_isolates(pth): # Isolate names of a multi-isolate fasta, from the headers only
+    names, missing = {}, []
+    with open_binary(pth) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                header = line[1:].decode().split()
+                name = header[0] if header else ''
+                if ISOLATE_SEPARATOR in name:
+                    names[name.split(ISOLATE_SEPARATOR, 1)[0]] = None
+                else:
+                    missing.append(name)
+    without_isolate(missing)
+    return list(names)
+
+def default_permissions(pth): # mkstemp creates files only the owner can read, give them the mode of any new file
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(pth, 0o666 & ~umask)
+
+def write_records(records, pth): # Compressed with gzip when pth ends in .gz, written to a temporary file first so readers never see half a file
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(pth), suffix='.tmp')
+    with (gzip.open(tmp, 'wt', compresslevel=1) if pth.endswith('.gz') else open(tmp, 'w')) as f:
+        for name, seq in records:
+            f.write(f">{name}\n")
+            for i in range(0, len(seq), 80):
+                f.write(seq[i:i + 80] + '\n')
+    os.close(handle)
+    default_permissions(tmp)
+    os.replace(tmp, pth)
+
+def split_path(splitdir, isolate):
+    return os.path.join(splitdir, f"{isolate}.fasta.gz")
+
+def write_split(isolates, splitdir):
+    os.makedirs(splitdir, exist_ok=True)
+    for isolate, records in isolates.items():
+        write_records(records, split_path(splitdir, isolate))
+    return [split_path(splitdir, isolate) for isolate in isolates]
+
+def discover_inputs(inp, splitdir, write=True, multi_isolate=False):
+    # One fasta path per isolate. With multi_isolate the fasta file (or fasta on stdin) holds several isolates, which are written
+    # to splitdir (gzip compressed) when write is True, otherwise only their future paths are given, for a script that runs
+    # next to the one splitting them. Without it a fasta file is one isolate, whatever its headers look like.
+    try:
+        if inp == '-':
+            data = sys.stdin.buffer.read()
+            if data.lstrip()[:1] == b'>':
+                if not write:
+                    raise SystemExit("fasta on stdin can only be read once, type it with blast_mrsa_mlva.py --stream")
+                records = parse_records(data)
+                return write_split(split_isolates(records) if multi_isolate else {'stdin': records}, splitdir)
+            candidates = [os.path.abspath(line) for line in data.decode().split()]
+        elif os.path.isdir(inp):
+            if multi_isolate:
+                raise SystemExit(f"--multi_isolate needs a single fasta file, {inp} is a directory")
+            candidates = sorted(glob.glob(os.path.abspath(f"{inp}/*")))
+        elif multi_isolate:
+            if not is_fasta(inp):
+                raise SystemExit(f"--multi_isolate needs a (compressed) fasta file, {inp} is not")
+            return write_split(split_isolates(read_records(inp)), splitdir) if write else [split_path(splitdir, isolate) for isolate in header_isolates(inp)]
+        else:
+            candidates = [os.path.abspath(inp)]
+    except ValueError as e: # Headers without an isolate name
+        raise SystemExit(f"{inp}: {e}")
+    inputs = [pth for pth in candidates if is_fasta(pth)]
+    for pth in sorted(set(candidates) - set(inputs)):
+        print(f"Skipping {pth}, not a (compressed) fasta file")
+    return inputs
+
+def query_pipe(pth, cmd): # cmd with the decompressed query piped into it, so blastn reads -query - instead of a file
+    # pipefail: a broken compressed file fails the search instead of giving blastn a truncated query
+    return ['bash', '-c', f"set -o pipefail; {' '.join(shlex.quote(c) for c in DECOMPRESS[compression(pth)] + [pth])} | {' '.join(shlex.quote(c) for c in cmd)}"]
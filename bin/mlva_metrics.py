@@ -0,0 +1,39 @@
+import contextlib, cProfile, json, os, resource, time
+
+# Wall time, CPU time, counts and peak RSS of every stage of every isolate, as one JSON object per line so the
+# processes of a pool can all append to the same file.
+
+class Metrics(object):
+
+    def __init__(self, path=None):
+        self.path = path # None records nothing
+
+    @contextlib.contextmanager
+    def stage(self, isolate, stage, **counts): # Yields the counts, so the stage can add what it found (like the number of hits)
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield counts
+        if self.path is not None:
+            self.record(isolate, stage, wall_s=round(time.perf_counter() - wall, 6), cpu_s=round(time.process_time() - cpu, 6), **counts)
+
+    def record(self, isolate, stage, **values):
+        if self.path is None:
+            return
+        values = dict(isolate=isolate, stage=stage, pid=os.getpid(), time=round(time.time(), 3),
+                      peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), **values) # ru_maxrss is in kB on Linux
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(values) + '\n')
+
+NO_METRICS = Metrics()
+
+_PROFILER = {} # One profiler per process, the stats of all isolates it typed add up
+
+def profiled(pth, per_process, func, *args): # Runs func under cProfile when pth is given, dumped to pth (.pid for pool workers)
+    if pth is None:
+        return func(*args)
+    profiler = _PROFILER.setdefault('profiler', cProfile.Profile())
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{pth}.{os.getpid()}" if per_process else pth)
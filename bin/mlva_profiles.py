@@ -0,0 +1,218 @@
+import argparse, glob, os, tempfile, textwrap
+import numpy as np
+from termcolor import colored
+from filter_mlva_blast import getmylogo
+from mlva_input import default_permissions
+from mlva_scheme import load_scheme, DEFAULT_SCHEME, NO_BIN
+
+# Store of MLVA profiles of many isolates as a small integer array (one row per isolate, one column per profile locus of the scheme,
+# NO_BIN where the locus was not found), so distances between thousands of profiles and the closest known profiles of a new
+# isolate are array operations instead of parsing *_MLVA.txt files. The distance of two profiles is the number of loci
+# with a different allele code, loci missing in either profile don't count.
+
+BLOCK_BYTES = 64 * 1024 * 1024 # Memory of the comparisons of one block of the distance matrix
+
+def parse_arguments(logo):
+    arg = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent(f"""
+        {colored(logo, 'red', attrs=["bold"])}
+        {colored('In silico MLVA typing for MRSA:', 'white', attrs=["bold", "underline"])}
+
+        Keeps the MLVA profiles of typed isolates in one file, finds the closest known profiles of new isolates,
+        writes the distance matrix and single linkage clusters of all stored profiles.
+-----------------------------------------------------------------------------------
+        {colored('Example usage:', 'green', attrs=["bold", "underline"])}
+            python {os.path.abspath(__file__)}
+            --store profiles.npz
+            --add example/output/mlva_typing/mlva_summary.tsv
+            --nearest 14-00-02-04-01-07-01-06)
+-----------------------------------------------------------------------------------
+        """))
+    arg.add_argument("-s",
+                    "--store",
+                    metavar="Path",
+                    help="Profile store (.npz), created when it doesn't exist yet",
+                    type=str,
+                    required=True)
+    arg.add_argument("-a",
+                    "--add",
+                    metavar="Path",
+                    help="Add the best profile of every isolate in these mlva_summary.tsv files or mlva_typing directories, replacing isolates stored before",
+                    type=str,
+                    nargs='+',
+                    default=[],
+                    required=False)
+    arg.add_argument("-n",
+                    "--nearest",
+                    metavar="Profile",
+                    help="Print the closest stored profiles of this profile, or of every isolate in a mlva_summary.tsv file or mlva_typing directory",
+                    type=str,
+                    required=False)
+    arg.add_argument("-k",
+                    metavar="INT",
+                    help="Number of closest profiles printed with --nearest (default: 5)",
+                    type=int,
+                    default=5,
+                    required=False)
+    arg.add_argument("-d",
+                    "--distances",
+                    metavar="Path",
+                    help="Write the distances between all stored profiles to this tab separated file",
+                    type=str,
+                    required=False)
+    arg.add_argument("-c",
+                    "--clusters",
+                    metavar="INT",
+                    help="Print single linkage clusters of the stored profiles, linking profiles with at most this many different loci",
+                    type=int,
+                    required=False)
+    arg.add_argument("--scheme",
+                    metavar="Path",
+                    help="JSON definition of the MLVA scheme, for the loci of the profiles (default: files/mrsa_scheme.json)",
+                    type=str,
+                    default=DEFAULT_SCHEME,
+                    required=False)
+    return arg.parse_args()
+
+def encode_profile(profile, loci): # 14-00-02-04-01-07-01-06 -> array of the allele codes
+    codes = [int(code) for code in profile.split('-')]
+    if len(codes) != len(loci):
+        raise ValueError(f"{profile} has {len(codes)} loci instead of {len(loci)}")
+    if max(codes) > np.iinfo(np.uint8).max:
+        raise ValueError(f"{profile} has an allele code above {np.iinfo(np.uint8).max}")
+    return np.array(codes, dtype=np.uint8)
+
+def decode_profile(codes):
+    return '-'.join(f"{int(code):02d}" for code in codes)
+
+def locus_distances(queries, profiles): # Number of loci that differ between every query (rows) and every profile (columns)
+    distances = np.zeros((len(queries), len(profiles)), dtype=np.uint8)
+    for locus in range(queries.shape[1]): # One rows x profiles comparison per locus, instead of one with a third axis for the loci
+        query, profile = queries[:, locus, None], np.ascontiguousarray(profiles[:, locus])[None, :]
+        distances += (query != profile) & (query != NO_BIN) & (profile != NO_BIN)
+    return distances
+
+class ProfileStore(object):
+
+    def __init__(self, loci, names=(), codes=None):
+        self.loci = list(loci)
+        self.names = list(names)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self._codes = np.zeros((max(len(self.names), 1024), len(self.loci)), dtype=np.uint8) # Grows by doubling while isolates are added
+        if codes is not None:
+            self._codes[:len(self.names)] = codes
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def codes(self):
+        return self._codes[:len(self.names)]
+
+    @classmethod
+    def load(cls, pth, loci):
+        if not os.path.exists(pth):
+            return cls(loci)
+        with np.load(pth, allow_pickle=False) as data:
+            if list(data['loci']) != list(loci):
+                raise ValueError(f"{pth} holds profiles of the loci {', '.join(data['loci'])}, not of {', '.join(loci)}")
+            return cls(loci, data['names'].tolist(), data['codes'])
+
+    def save(self, pth): # Written to a temporary file first, so a crash never leaves half a store
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pth)), suffix='.npz')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, names=np.array(self.names, dtype=str), codes=self.codes, loci=np.array(self.loci, dtype=str))
+        default_permissions(tmp)
+        os.replace(tmp, pth)
+
+    def add(self, name, profile): # An isolate that is stored already gets its new profile
+        if name not in self.rows:
+            if len(self.names) == len(self._codes):
+                self._codes = np.concatenate((self._codes, np.zeros_like(self._codes)))
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+        self._codes[self.rows[name]] = encode_profile(profile, self.loci)
+
+    def distance_blocks(self, queries=None, block_bytes=BLOCK_BYTES): # Yields (first query row, distances), a few query rows at a time
+        queries = self.codes if queries is None else queries
+        rows = max(1, block_bytes // (4 * max(len(self), 1))) # The distances and three boolean arrays of rows x profiles
+        for start in range(0, len(queries), rows):
+            yield start, locus_distances(queries[start:start + rows], self.codes)
+
+    def nearest(self, profile, k=5): # [(name, distance, profile)] of the k closest stored profiles, closest first
+        distances = locus_distances(encode_profile(profile, self.loci)[None, :], self.codes)[0]
+        closest = np.argsort(distances, kind='stable')[:k] # Ties in the order the isolates were added
+        return [(self.names[row], int(distances[row]), decode_profile(self.codes[row])) for row in closest]
+
+    def clusters(self, max_distance): # Cluster number of every stored isolate, single linkage
+        # Identical profiles are one cluster anyway, so only the distinct profiles are compared
+        unique, inverse = np.unique(self.codes, axis=0, return_inverse=True)
+        root = np.arange(len(unique)) # Cluster of every distinct profile, as the smallest profile number in it
+        distinct = ProfileStore(self.loci, codes=unique, names=range(len(unique)))
+        for start, distances in distinct.distance_blocks():
+            i, j = np.nonzero(distances <= max_distance)
+            i += start
+            pairs = np.unique(np.stack((root[i], root[j]), axis=1), axis=0) # Only links between clusters that are still apart
+            for a, b in pairs[pairs[:, 0] != pairs[:, 1]].tolist():
+                while root[a] != a:
+                    a = root[a]
+                while root[b] != b:
+                    b = root[b]
+                root[max(a, b)] = min(a, b)
+            while (root[root] != root).any():
+                root = root[root]
+        roots = root[inverse.ravel()]
+        clusters, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+        order = np.empty(len(clusters), dtype=np.int64)
+        order[np.argsort(first)] = np.arange(1, len(clusters) + 1) # Numbered in the order their first isolate was added
+        return order[labels]
+
+def read_profiles(pth): # [(isolate, best profile)] of a mlva_summary.tsv or of the *_MLVA.txt files of a mlva_typing directory
+    profiles = []
+    if os.path.isdir(pth):
+        for txt in sorted(glob.glob(f"{pth}/*_MLVA.txt")):
+            with open(txt) as f:
+                profiles.append((os.path.basename(txt)[:-len('_MLVA.txt')], f.readline().split(':', 1)[1].strip()))
+        return profiles
+    with open(pth) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').split('\t')))
+            if row['profile_rank'] == '1':
+                profiles.append((row['isolate'], row['profile']))
+    return profiles
+
+def write_distances(store, pth):
+    with open(pth, 'w') as f:
+        f.write('\t'.join(['isolate'] + store.names) + '\n')
+        for start, distances in store.distance_blocks():
+            for row, line in enumerate(distances):
+                f.write('\t'.join([store.names[start + row]] + [str(d) for d in line.tolist()]) + '\n')
+
+def main():
+    current_file_path = os.path.abspath(__file__)
+    parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
+    flags = parse_arguments(getmylogo(os.path.join(parent_dir_path, "files", "logo.txt")))
+
+    store = ProfileStore.load(flags.store, load_scheme(flags.scheme).profile_loci)
+    if len(flags.add) > 0:
+        for pth in flags.add:
+            for name, profile in read_profiles(pth):
+                store.add(name, profile)
+        store.save(flags.store)
+        print(f"{len(store)} profiles in {flags.store}")
+    if flags.nearest is not None:
+        queries = read_profiles(flags.nearest) if os.path.exists(flags.nearest) else [('profile', flags.nearest)]
+        print('\t'.join(['query', 'query_profile', 'rank', 'isolate', 'distance', 'profile']))
+        for query, profile in queries:
+            for rank, (name, distance, stored) in enumerate(store.nearest(profile, flags.k)):
+                print(f"{query}\t{profile}\t{rank + 1}\t{name}\t{distance}\t{stored}")
+    if flags.distances is not None:
+        write_distances(store, flags.distances)
+    if flags.clusters is not None:
+        print('\t'.join(['isolate', 'cluster', 'profile']))
+        for name, cluster, codes in zip(store.names, store.clusters(flags.clusters), store.codes):
+            print(f"{name}\t{cluster}\t{decode_profile(codes)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import collections, hashlib, json, os, pickle, tempfile, types
+from lazy_imports import lazy_import
+from mlva_input import read_records, default_permissions
+
+# An MLVA scheme is defined in a json file (files/mrsa_scheme.json): the primer pairs of every locus with their bitscore
+# cutoff, the loci typed by counting repeats instead of by product size, the order of the loci in the profile, the markers
+# reported as a status (MecA, PVL) and the primer, repeat and bin files. It is compiled once into an immutable MlvaScheme:
+# every primer and repeat name gets an integer ID, and arrays indexed by primer ID give its locus, direction and cutoff,
+# so the typing selects hits with array lookups instead of comparing names. A new scheme only needs a new json file.
+
+SCHEME_FORMAT = 1 # Compiled schemes of another format are compiled again
+FORWARD, REVERSE = 0, 1
+NO_BIN = 99 # Allele code when no bin is found for a locus
+NOT_IN_SCHEME = -1 # ID of the names that are no primer or repeat of the scheme, and locus of primers of no locus
+DEFAULT_SCHEME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files", "mrsa_scheme.json")
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+CountedLocus = collections.namedtuple('CountedLocus', ['locus', 'forward', 'reverse', 'repeat', 'forward_min_bitscore', 'repeat_min_bitscore'])
+Marker = collections.namedtuple('Marker', ['marker', 'column', 'loci', 'absent', 'failed', 'values'])
+
+class BinIndex(object):
+    # The bins of mrsa_mappings.csv as sorted start/stop/value arrays per VNTR, so a size is looked up with a binary search
+    def __init__(self, df_mappings):
+        self.bins = {}
+        for vntr, group in df_mappings.groupby('VNTR', sort=False):
+            group = group.sort_values('Start', kind='mergesort')
+            starts, stops, values = group['Start'].values.astype(float), group['Stop'].values.astype(float), group['Value'].values.astype(np.int64) # Some bin edges are fractional
+            if (starts[1:] <= stops[:-1]).any():
+                raise ValueError(f"Overlapping bins for {vntr} in the mappings")
+            self.bins[vntr] = (starts, stops, values)
+
+    def lookup(self, vntr, sizes, nearest=False): # Bin value of every size, NO_BIN outside all bins unless the nearest bin is asked for
+        sizes = np.asarray(sizes, dtype=float)
+        if vntr not in self.bins:
+            return np.full(len(sizes), NO_BIN, dtype=np.int64)
+        starts, stops, values = self.bins[vntr]
+        below = np.searchsorted(starts, sizes, side='right') - 1
+        inside = (below >= 0) & (sizes <= stops[np.maximum(below, 0)])
+        if not nearest:
+            return np.where(inside, values[np.maximum(below, 0)], NO_BIN)
+        # Closest bin by |start - size| + |stop - size|, outside all bins that is the bin just below or just above the size
+        lower, upper = np.clip(below, 0, len(starts) - 1), np.clip(below + 1, 0, len(starts) - 1)
+        upper_closer = np.abs(starts[upper] - sizes) + np.abs(stops[upper] - sizes) < np.abs(starts[lower] - sizes) + np.abs(stops[lower] - sizes)
+        return np.where(inside, values[np.maximum(below, 0)], values[np.where(upper_closer, upper, lower)])
+
+    def value(self, vntr, size, nearest=False):
+        return int(self.lookup(vntr, [size], nearest)[0])
+
+def fasta_names(pth):
+    return [name for name, seq in read_records(pth)]
+
+class MlvaScheme(object):
+    _MAPPINGS = ('primer_id', 'repeat_id', 'locus_id', 'counted') # Read-only views, plain dicts while pickled
+
+    def __init__(self, definition, pth):
+        base = os.path.dirname(os.path.abspath(pth))
+        self.name = definition['name']
+        self.definition = os.path.abspath(pth)
+        self.primer_file, self.repeat_file, self.bin_file = (os.path.join(base, definition[f]) for f in ('primers', 'repeats', 'bins'))
+        self.digest = scheme_digest(pth, definition)
+        self.max_product_size = int(definition['max_product_size'])
+        self.pairs = tuple((l['locus'], l['forward'], l['reverse'], float(l['min_bitscore'])) for l in definition['loci'])
+        self.loci = tuple(locus for locus, forward, reverse, min_bitscore in self.pairs)
+        self.locus_id = {locus: i for i, locus in enumerate(self.loci)}
+        self.primers = tuple(fasta_names(self.primer_file))
+        self.primer_id = {name: i for i, name in enumerate(self.primers)}
+        self.repeats = tuple(fasta_names(self.repeat_file))
+        self.repeat_id = {name: i for i, name in enumerate(self.repeats)}
+        # Per primer ID: the locus it amplifies, forward or reverse and the bitscore its hits need
+        self.primer_locus = np.full(len(self.primers), NOT_IN_SCHEME, dtype=np.int64)
+        self.primer_direction = np.zeros(len(self.primers), dtype=np.int8)
+        self.primer_min_bitscore = np.zeros(len(self.primers), dtype=float)
+        for locus, forward, reverse, min_bitscore in self.pairs:
+            for primer, direction in ((forward, FORWARD), (reverse, REVERSE)):
+                if primer not in self.primer_id:
+                    raise ValueError(f"Primer {primer} of {locus} is not in {self.primer_file}")
+                if self.primer_locus[self.primer_id[primer]] != NOT_IN_SCHEME:
+                    raise ValueError(f"Primer {primer} is used by more than one locus")
+                self.primer_locus[self.primer_id[primer]] = self.locus_id[locus]
+                self.primer_direction[self.primer_id[primer]] = direction
+                self.primer_min_bitscore[self.primer_id[primer]] = min_bitscore
+        self.counted = {}
+        for c in definition.get('counted', []):
+            if c['repeat'] not in self.repeat_id:
+                raise ValueError(f"Repeat {c['repeat']} of {c['locus']} is not in {self.repeat_file}")
+            self.counted[c['locus']] = CountedLocus(c['locus'], self.primer_id[c['forward']], self.primer_id[c['reverse']], self.repeat_id[c['repeat']],
+                                                    float(c['forward_min_bitscore']), float(c['repeat_min_bitscore']))
+        self.profile_loci = tuple(definition['profile'])
+        for locus in self.profile_loci:
+            if locus not in self.locus_id and locus not in self.counted:
+                raise ValueError(f"Profile locus {locus} has no primers in the scheme")
+        self.markers = tuple(Marker(m['marker'], m['column'], tuple(m['loci']), m['absent'], m['failed'],
+                                    types.MappingProxyType({int(v): status for v, status in m['values'].items()}))
+                             for m in definition['markers'])
+        self.bins = BinIndex(pd.read_csv(self.bin_file, sep=","))
+        self._freeze()
+
+    def _freeze(self):
+        for name in self._MAPPINGS:
+            object.__setattr__(self, name, types.MappingProxyType(dict(getattr(self, name))))
+        arrays = [self.primer_locus, self.primer_direction, self.primer_min_bitscore] + [a for bins in self.bins.bins.values() for a in bins]
+        for array in arrays:
+            array.flags.writeable = False
+        object.__setattr__(self, '_frozen', True)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"a compiled scheme can't be changed, {name} stays as it is")
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update({name: dict(state[name]) for name in self._MAPPINGS})
+        state['markers'] = tuple(m._replace(values=dict(m.values)) for m in self.markers)
+        del state['_frozen']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        object.__setattr__(self, 'markers', tuple(m._replace(values=types.MappingProxyType(m.values)) for m in self.markers))
+        self._freeze()
+
+    def ids(self, names, mapping): # Integer ID of every name (a categorical column or any sequence), NOT_IN_SCHEME for others
+        if isinstance(names, pd.Series) and str(names.dtype) == 'category':
+            lookup = np.array([mapping.get(name, NOT_IN_SCHEME) for name in names.cat.categories], dtype=np.int64)
+            codes = names.cat.codes.values
+            return np.where(codes >= 0, lookup[np.maximum(codes, 0)] if len(lookup) > 0 else NOT_IN_SCHEME, NOT_IN_SCHEME)
+        return np.array([mapping.get(name, NOT_IN_SCHEME) for name in names], dtype=np.int64)
+
+    def primer_ids(self, names):
+        return self.ids(names, self.primer_id)
+
+    def repeat_ids(self, names):
+        return self.ids(names, self.repeat_id)
+
+    def save(self, pth): # Written to a temporary file first, other processes only ever read complete schemes
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pth)), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        default_permissions(tmp)
+        os.replace(tmp, pth)
+
+def scheme_digest(pth, definition=None): # Changes with the definition, the files it names and the compiled format
+    definition = definition or read_definition(pth)
+    base = os.path.dirname(os.path.abspath(pth))
+    digest = hashlib.sha256(f"{SCHEME_FORMAT}".encode())
+    with open(pth, 'rb') as f:
+        digest.update(f.read())
+    for name in ('primers', 'repeats', 'bins'):
+        with open(os.path.join(base, definition[name]), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def read_definition(pth):
+    with open(pth) as f:
+        return json.load(f)
+
+_SCHEMES = {} # Compiled scheme per definition file, once per process. Pool workers forked after loading share it read-only
+
+def compiled_path(cache_dir, pth, definition): # The compiled scheme holds the absolute paths of its files, so its location is part of the name
+    location = hashlib.sha256(os.path.realpath(pth).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"scheme_{scheme_digest(pth, definition)}_{location}.pickle")
+
+def load_scheme(pth=DEFAULT_SCHEME, cache_dir=None): # With cache_dir the compiled scheme is stored there and loaded instead of compiled
+    pth = os.path.abspath(pth)
+    if pth in _SCHEMES:
+        return _SCHEMES[pth]
+    definition = read_definition(pth)
+    compiled = None if cache_dir is None else compiled_path(cache_dir, pth, definition)
+    if compiled is not None and os.path.exists(compiled):
+        with open(compiled, 'rb') as f:
+            _SCHEMES[pth] = pickle.load(f)
+    else:
+        _SCHEMES[pth] = MlvaScheme(definition, pth)
+        if compiled is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            _SCHEMES[pth].save(compiled)
+    return _SCHEMES[pth]
@@ -0,0 +1,171 @@
+import argparse, json, os, signal, socketserver, sys, textwrap, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from termcolor import colored
+import native_search
+from filter_mlva_blast import getmylogo, type_hits, mec_or_pvl, write_to_file, summary_rows, MAX_PROFILES
+from mlva_scheme import load_scheme, DEFAULT_SCHEME
+from mlva_metrics import Metrics
+from mlva_input import isolate_name
+
+# Long running typing service: the search index of the primers and repeats and the compiled scheme stay in memory, so every
+# request only pays for the search of its own assembly. Typing requests are HTTP, on a local port or on a Unix socket:
+#   curl --unix-socket mlva.sock -d '{"path": "/data/RIVM_M096462.fasta"}' http://localhost/type
+
+def parse_arguments(logo):
+    arg = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent(f"""
+        {colored(logo, 'red', attrs=["bold"])}
+        {colored('In silico MLVA typing for MRSA:', 'white', attrs=["bold", "underline"])}
+
+        Keeps the primers, repeats and bins in memory and types assemblies on request.
+        POST /type with {{"path": "assembly.fasta"}} or {{"name": "isolate", "fasta": ">contig1..."}},
+        the answer holds the profiles and the MecA/PVL status. GET /health tells if the service is up.
+-----------------------------------------------------------------------------------
+        {colored('Example usage:', 'green', attrs=["bold", "underline"])}
+            python {os.path.abspath(__file__)}
+            --socket /tmp/mlva.sock)
+-----------------------------------------------------------------------------------
+        """))
+    arg.add_argument("-u",
+                    "--socket",
+                    metavar="Path",
+                    help="Listen on this Unix socket",
+                    type=str,
+                    required=False)
+    arg.add_argument("-p",
+                    "--port",
+                    metavar="INT",
+                    help="Listen on this port of localhost instead",
+                    type=int,
+                    required=False)
+    arg.add_argument("-pi",
+                    "--perc_identity",
+                    metavar="INT",
+                    help="Percentage of identity to use to search for in the primers",
+                    type=int,
+                    default=50,
+                    required=False)
+    arg.add_argument("-o",
+                    "--output",
+                    metavar="Path",
+                    help="Also write the *_MLVA.txt file of every typed isolate to this directory",
+                    type=str,
+                    required=False)
+    arg.add_argument("--scheme",
+                    metavar="Path",
+                    help="JSON definition of the MLVA scheme: primers, repeats, loci, bitscore cutoffs, bins and markers (default: files/mrsa_scheme.json)",
+                    type=str,
+                    default=DEFAULT_SCHEME,
+                    required=False)
+    arg.add_argument("--metrics",
+                    metavar="Path",
+                    help="Append the time of every stage of every request to this JSON lines file",
+                    type=str,
+                    required=False)
+    flags = arg.parse_args()
+    if (flags.socket is None) == (flags.port is None):
+        arg.error("give either --socket or --port")
+    return flags
+
+class TypingService(object):
+
+    def __init__(self, scheme, perc_identity=50, outdir=None, metrics=None):
+        primers = native_search.read_fasta(scheme.primer_file)
+        self.primer_names = {name for name, seq in primers}
+        self.index = native_search.SubjectIndex(primers + native_search.read_fasta(scheme.repeat_file)) # One search finds primers and repeats
+        self.scheme = scheme
+        self.perc_identity, self.outdir, self.metrics = perc_identity, outdir, metrics or Metrics()
+
+    def type_records(self, name, records, max_profiles=MAX_PROFILES):
+        start = time.perf_counter()
+        with self.metrics.stage(name, 'search') as counts:
+            primer_rows, repeat_rows = [], []
+            for row in native_search.search_records(records, self.index, self.perc_identity):
+                (primer_rows if row[1] in self.primer_names else repeat_rows).append(row)
+            counts['primer_hits'], counts['repeat_hits'] = len(primer_rows), len(repeat_rows)
+        profiles_in_a_list, MLVA_dict = type_hits(primer_rows, repeat_rows, self.scheme, max_profiles, self.metrics, name)
+        output_mecpvl = mec_or_pvl(self.scheme, MLVA_dict)
+        if self.outdir is not None:
+            write_to_file(profiles_in_a_list, self.scheme, MLVA_dict, name, self.outdir, output_mecpvl)
+        markers = {marker.column: output_mecpvl.get(marker.marker, '') for marker in self.scheme.markers} # MecA and PVL
+        return dict(isolate=name, profile=profiles_in_a_list[0], profiles=profiles_in_a_list, **markers,
+                    summary=summary_rows(name, profiles_in_a_list, output_mecpvl, MLVA_dict, self.scheme),
+                    primer_hits=len(primer_rows), repeat_hits=len(repeat_rows), seconds=round(time.perf_counter() - start, 3))
+
+    def handle(self, request): # The JSON body of a /type request
+        if 'path' in request:
+            name = request.get('name', isolate_name(request['path']))
+            records = native_search.read_fasta(request['path'])
+        elif 'fasta' in request:
+            name, records = request.get('name', 'isolate'), native_search.parse_fasta(request['fasta'])
+        else:
+            raise ValueError("give the assembly as path or as fasta text")
+        if len(records) == 0:
+            raise ValueError(f"no fasta records for {name}")
+        return self.type_records(name, records, int(request.get('max_profiles', MAX_PROFILES)))
+
+class TypingHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def address_string(self): # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, {'status': 'ok'})
+        else:
+            self.reply(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/type':
+            self.reply(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            self.reply(200, self.service.handle(request))
+        except (ValueError, OSError) as e:
+            self.reply(400, {'error': str(e)})
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def server_bind(self): # Same attributes HTTPServer sets, BaseHTTPRequestHandler uses them
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+def make_server(service, socket_path=None, port=None):
+    TypingHandler.service = service
+    if socket_path is not None:
+        if os.path.exists(socket_path): # Left over from a service that didn't shut down cleanly
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, TypingHandler)
+    return HTTPServer(('127.0.0.1', port), TypingHandler)
+
+def main():
+    current_file_path = os.path.abspath(__file__)
+    parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
+    flags = parse_arguments(getmylogo(os.path.join(parent_dir_path, "files", "logo.txt")))
+
+    if flags.output is not None:
+        os.makedirs(flags.output, exist_ok=True)
+    service = TypingService(load_scheme(flags.scheme), flags.perc_identity, flags.output, Metrics(flags.metrics))
+    server = make_server(service, flags.socket, flags.port)
+    print(f"Typing service listening on {flags.socket or f'http://127.0.0.1:{flags.port}'}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Stopped by a service manager, clean up the socket as well
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if flags.socket is not None and os.path.exists(flags.socket):
+            os.remove(flags.socket)
+
+if __name__ == "__main__":
+    main()
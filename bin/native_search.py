@@ -0,0 +1,293 @@
+import argparse, math, sys
+import numpy as np
+from mlva_input import read_records
+
+# In-process stand-in for `blastn -word_size 7 -outfmt 10` on the short MLVA primers and repeat units.
+# Seeds are exact 7-mers shared by a contig and a primer (both strands), every seed diagonal gets a banded
+# local alignment and only alignments that blastn would report (E-value <= 10, perc_identity) are written,
+# with the same 12 columns and megablast scoring so the bitscore cutoffs of the typing stay valid.
+
+WORD_SIZE = 7
+BAND = 3 # Number of diagonals on either side of a seed diagonal the alignment may drift to
+MATCH, MISMATCH, GAP = 2, -4, -5 # Twice the megablast reward/penalty (1/-2) and linear gap cost (2.5), keeps the DP in integers
+LAMBDA, K, H, ALPHA, BETA = 1.28, 0.46, 0.85, 1.5, -2 # Karlin-Altschul parameters blastn uses for reward 1, penalty -2 and linear gaps
+EVALUE = 10
+BLAST_HEADER = ['qseqid','sseqid','pident','length','mismatch','gapopen','qstart','qend','sstart','send','evalue','bitscore']
+
+_CODE = np.full(256, 4, dtype=np.uint8)
+for _i, _b in enumerate(b'ACGT'):
+    _CODE[_b] = _i
+    _CODE[ord(chr(_b).lower())] = _i
+
+def read_fasta(pth): # Plain, gzip, bgzip or zstd compressed fasta, or - for stdin
+    return read_records(pth)
+
+def parse_fasta(text):
+    records = []
+    for entry in text.split('>')[1:]:
+        header, _, seq = entry.partition('\n')
+        records.append((header.split()[0], seq.replace('\n', '').replace('\r', '')))
+    return records
+
+def encode(seq): # A, C, G, T as 0-3, anything else (N, IUPAC) as 4
+    return _CODE[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+def reverse_complement(codes):
+    rc = 3 - codes[::-1]
+    rc[codes[::-1] == 4] = 4
+    return rc
+
+def kmer_codes(codes): # Integer code of every k-mer, -1 where the k-mer contains an N
+    n = len(codes) - WORD_SIZE + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int32)
+    kmers = np.zeros(n, dtype=np.int32)
+    for j in range(WORD_SIZE):
+        kmers = kmers * 4 + (codes[j:j + n] & 3)
+    unknown = np.concatenate(([0], np.cumsum(codes == 4)))
+    kmers[(unknown[WORD_SIZE:] - unknown[:n]) > 0] = -1
+    return kmers
+
+class SubjectIndex(object):
+    # k-mer index over both strands of all primers/repeat units. Every entry says which subject, strand and offset a k-mer is found at.
+    def __init__(self, records):
+        self.names = [name for name, seq in records]
+        self.lengths = np.array([len(seq) for name, seq in records], dtype=np.int64)
+        self.strands = [] # per subject: (plus strand codes, minus strand codes)
+        codes, subjects, strands, offsets = [], [], [], []
+        for s, (name, seq) in enumerate(records):
+            plus = encode(seq)
+            minus = reverse_complement(plus)
+            self.strands.append((plus, minus))
+            for strand, oriented in enumerate((plus, minus)):
+                kmers = kmer_codes(oriented)
+                valid = np.nonzero(kmers >= 0)[0]
+                codes.append(kmers[valid])
+                offsets.append(valid)
+                subjects.append(np.full(len(valid), s, dtype=np.int64))
+                strands.append(np.full(len(valid), strand, dtype=np.int64))
+        codes = np.concatenate(codes)
+        order = np.argsort(codes, kind='mergesort')
+        self.codes = codes[order]
+        self.subjects = np.concatenate(subjects)[order]
+        self.strand = np.concatenate(strands)[order]
+        self.offsets = np.concatenate(offsets).astype(np.int64)[order]
+
+def load_subjects(pth):
+    return SubjectIndex(read_fasta(pth))
+
+def length_adjustment(m, n): # BLAST_ComputeLengthAdjustment for a single subject sequence
+    alpha_d_lambda = ALPHA / LAMBDA
+    log_k = math.log(K)
+    c = n * m - max(m, n) / K
+    if c < 0:
+        return 0
+    mb = m + n
+    ell_max = 2 * c / (mb + math.sqrt(mb * mb - 4 * c))
+    ell, ell_min, converged = 0.0, 0.0, False
+    for i in range(1, 21):
+        ell_bar = ell
+        ell = alpha_d_lambda * (log_k + math.log((m - ell) * (n - ell))) + BETA
+        if ell >= ell_bar:
+            ell_min = ell_bar
+            if ell - ell_min <= 1.0:
+                converged = True
+                break
+            if ell_min == ell_max:
+                break
+        else:
+            ell_max = ell_bar
+        if not ell_min <= ell <= ell_max:
+            ell = ell_max if i == 1 else (ell_min + ell_max) / 2
+    adjustment = int(ell_min)
+    if converged:
+        ell = math.ceil(ell_min)
+        if ell <= ell_max and alpha_d_lambda * (log_k + math.log((m - ell) * (n - ell))) + BETA <= ell:
+            adjustment = int(ell)
+    return adjustment
+
+def search_space(m, n):
+    adjustment = length_adjustment(m, n)
+    return max(m - adjustment, 1) * max(n - adjustment, 1 / K)
+
+def bitscore(raw):
+    return (LAMBDA * raw - math.log(K)) / math.log(2)
+
+def format_evalue(evalue): # Same rounding as blast tabular output
+    if evalue < 1.0e-180:
+        return "0.0"
+    if evalue < 1.0e-99:
+        return f"{evalue:.0e}"
+    if evalue < 0.0009:
+        return f"{evalue:.2e}"
+    if evalue < 0.1:
+        return f"{evalue:.3f}"
+    if evalue < 1.0:
+        return f"{evalue:.2f}"
+    if evalue < 10.0:
+        return f"{evalue:.1f}"
+    return f"{evalue:.0f}"
+
+def format_bitscore(bits):
+    if bits > 9999:
+        return f"{bits:.3e}"
+    if bits > 99.9:
+        return f"{int(bits)}"
+    return f"{bits:.1f}"
+
+def find_seeds(contig, index): # Unique (subject, strand, diagonal) of every exact k-mer match, diagonal = contig position of subject position 0
+    kmers = kmer_codes(contig)
+    positions = np.nonzero(np.isin(kmers, index.codes))[0]
+    lo = np.searchsorted(index.codes, kmers[positions], side='left')
+    hi = np.searchsorted(index.codes, kmers[positions], side='right')
+    counts = hi - lo
+    entries = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    seed_pos = np.repeat(positions, counts)
+    span = len(contig) + int(index.lengths.max()) + 1 # diagonals run from -max length to the contig length
+    keys = np.unique((index.subjects[entries] * 2 + index.strand[entries]) * span + seed_pos - index.offsets[entries] + int(index.lengths.max()))
+    return keys // (2 * span), keys // span % 2, keys % span - int(index.lengths.max())
+
+def banded_scores(padded, pad, oriented, diagonals): # Best local alignment score around every diagonal, vectorized over all seeds of one subject
+    band = np.arange(-BAND, BAND + 1)
+    previous = np.zeros((len(diagonals), len(band)), dtype=np.int32)
+    best = np.zeros(len(diagonals), dtype=np.int32)
+    for i in range(len(oriented)):
+        contig_bases = padded[(diagonals + pad + i)[:, None] + band]
+        current = previous + np.where(contig_bases == oriented[i], MATCH, MISMATCH)
+        current[:, :-1] = np.maximum(current[:, :-1], previous[:, 1:] + GAP) # gap in the contig
+        np.maximum(current, 0, out=current)
+        for j in range(1, len(band)):
+            np.maximum(current[:, j], current[:, j - 1] + GAP, out=current[:, j]) # gap in the subject
+        np.maximum(best, current.max(axis=1), out=best)
+        previous = current
+    return best
+
+def ungapped_alignments(padded, pad, oriented, diagonals): # Best gapless segment on every diagonal, vectorized over all seeds of one subject
+    positions = (diagonals + pad)[:, None] + np.arange(len(oriented))
+    same = padded[positions] == oriented
+    cumulative = np.zeros((len(diagonals), len(oriented) + 1), dtype=np.int32)
+    np.cumsum(np.where(same, MATCH, MISMATCH), axis=1, out=cumulative[:, 1:])
+    gain = cumulative - np.minimum.accumulate(cumulative, axis=1)
+    end = gain.argmax(axis=1) # first (shortest) end reaching the best score
+    rows = np.arange(len(diagonals))
+    before_end = np.where(np.arange(len(oriented) + 1) <= end[:, None], cumulative, np.iinfo(np.int32).max)
+    start = len(oriented) - before_end[:, ::-1].argmin(axis=1) # last (shortest) start with the lowest prefix score
+    matched = np.concatenate((np.zeros((len(diagonals), 1), dtype=np.int32), np.cumsum(same, axis=1, dtype=np.int32)), axis=1)
+    matches = matched[rows, end] - matched[rows, start]
+    return gain[rows, end], start, end, matches
+
+def align(contig, oriented, diagonal): # Smith-Waterman with traceback in the window around one diagonal
+    lo = max(diagonal - BAND, 0)
+    window = contig[lo:min(diagonal + len(oriented) + BAND, len(contig))].tolist()
+    subject = oriented.tolist()
+    substitution = [[MATCH if w == b and b != 4 else MISMATCH for w in window] for b in subject]
+    score = [[0] * (len(window) + 1) for _ in range(len(subject) + 1)]
+    best, best_cell = 0, (0, 0)
+    for i in range(1, len(subject) + 1):
+        row, above, sub = score[i], score[i - 1], substitution[i - 1]
+        for j in range(1, len(window) + 1):
+            s = max(0, above[j - 1] + sub[j - 1], above[j] + GAP, row[j - 1] + GAP)
+            row[j] = s
+            if s > best:
+                best, best_cell = s, (i, j)
+    i, j = best_cell
+    matches = mismatches = gapopen = length = 0
+    previous_move = None
+    while i > 0 and j > 0 and score[i][j] > 0:
+        if score[i][j] == score[i - 1][j - 1] + substitution[i - 1][j - 1]:
+            if substitution[i - 1][j - 1] == MATCH:
+                matches += 1
+            else:
+                mismatches += 1
+            i, j, move = i - 1, j - 1, 'diagonal'
+        elif score[i][j] == score[i - 1][j] + GAP:
+            i, move = i - 1, 'up'
+        else:
+            j, move = j - 1, 'left'
+        if move != 'diagonal' and move != previous_move:
+            gapopen += 1
+        previous_move = move
+        length += 1
+    # 1-based, inclusive: subject start/end on the oriented strand, contig start/end
+    return best, matches, mismatches, gapopen, length, i + 1, best_cell[0], lo + j + 1, lo + best_cell[1]
+
+def search_contig(name, seq, index, perc_identity):
+    contig = encode(seq)
+    hits = []
+    if len(contig) < WORD_SIZE:
+        return hits
+    seed_subjects, seed_strands, seed_diagonals = find_seeds(contig, index)
+    pad = int(index.lengths.max()) + BAND + 1
+    padded = np.concatenate((np.full(pad, 5, dtype=np.uint8), contig, np.full(pad, 5, dtype=np.uint8))) # 5 never matches a base
+    for s in np.unique(seed_subjects):
+        length = int(index.lengths[s])
+        space = search_space(len(contig), length)
+        min_raw = (math.log(K * space) - math.log(EVALUE)) / LAMBDA # Anything scoring lower has an E-value above 10
+        for strand in (0, 1):
+            oriented = index.strands[s][strand]
+            diagonals = seed_diagonals[(seed_subjects == s) & (seed_strands == strand)]
+            if len(diagonals) == 0:
+                continue
+            # Like blastn, only seeds whose gapless extension already reaches the cutoff get a gapped extension
+            ungapped, start, end, matches = ungapped_alignments(padded, pad, oriented, diagonals)
+            passing = ungapped / 2 >= min_raw
+            diagonals, ungapped, start, end, matches = diagonals[passing], ungapped[passing], start[passing], end[passing], matches[passing]
+            gapless = ungapped == banded_scores(padded, pad, oriented, diagonals) # No gap improves on these, so the gapless segment is the alignment
+            alignments = [(int(score), int(m), int(e - b - m), 0, int(e - b), int(b) + 1, int(e), int(d + b) + 1, int(d + e))
+                          for score, m, b, e, d in zip(ungapped[gapless], matches[gapless], start[gapless], end[gapless], diagonals[gapless])]
+            alignments.extend(align(contig, oriented, int(d)) for d in diagonals[~gapless])
+            found = {}
+            for aln in alignments:
+                raw = aln[0] / 2
+                if raw < min_raw or aln[1] * 100 < perc_identity * aln[4]:
+                    continue
+                found.setdefault(aln[5:], aln) # Neighbouring diagonals end up in the same alignment
+            kept = []
+            for aln in sorted(found.values(), key=lambda a: -a[0]): # Drop alignments contained in a better one, like blast does
+                if any(k[7] <= aln[7] and aln[8] <= k[8] for k in kept):
+                    continue
+                kept.append(aln)
+            for raw2, matches, mismatches, gapopen, aln_length, s_start, s_end, q_start, q_end in kept:
+                raw = raw2 / 2
+                if strand == 1: # Report minus strand hits on the original subject coordinates, start > end
+                    s_start, s_end = length - s_start + 1, length - s_end + 1
+                evalue = K * space * math.exp(-LAMBDA * raw)
+                hits.append((evalue, -raw, [name, index.names[s], f"{100 * matches / aln_length:.3f}", str(aln_length), str(mismatches), str(gapopen),
+                                            str(q_start), str(q_end), str(s_start), str(s_end), format_evalue(evalue), format_bitscore(bitscore(raw))]))
+    return [hit for evalue, raw, hit in sorted(hits, key=lambda h: (h[0], h[1]))]
+
+def search_records(records, index, perc_identity): # Yields the 12 blast columns as strings, like csv.reader on blastn -outfmt 10
+    for name, seq in records:
+        for hit in search_contig(name, seq, index, perc_identity):
+            yield hit
+
+def search_file(query, subject, out, perc_identity):
+    index = load_subjects(subject)
+    f = sys.stdout if out == '-' else open(out, 'w')
+    for name, seq in read_fasta(query):
+        for hit in search_contig(name, seq, index, perc_identity):
+            f.write(','.join(hit) + '\n')
+        f.flush() # Whoever reads the output as a stream gets the hits of every contig straight away
+    if f is not sys.stdout:
+        f.close()
+
+def parse_arguments(): # Accepts the blastn options blast_mrsa_mlva.py uses, so both engines share one command line
+    arg = argparse.ArgumentParser(description="Native blastn -outfmt 10 replacement for the MLVA primers and repeat sequences")
+    arg.add_argument("-query", required=True)
+    arg.add_argument("-subject", required=True)
+    arg.add_argument("-out", required=True)
+    arg.add_argument("-perc_identity", type=float, default=0)
+    arg.add_argument("-word_size", type=int, default=WORD_SIZE)
+    arg.add_argument("-num_threads", type=int, default=1)
+    arg.add_argument("-outfmt", default='10')
+    flags = arg.parse_args()
+    if flags.word_size != WORD_SIZE or flags.outfmt != '10':
+        sys.exit(f"native search only supports -word_size {WORD_SIZE} -outfmt 10")
+    return flags
+
+def main():
+    flags = parse_arguments()
+    search_file(flags.query, flags.subject, flags.out, flags.perc_identity)
+
+if __name__ == "__main__":
+    main()
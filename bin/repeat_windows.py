@@ -0,0 +1,83 @@
+import argparse, csv, os, subprocess, sys, tempfile
+from mlva_input import read_records
+from mlva_scheme import load_scheme, DEFAULT_SCHEME
+
+# Two-pass repeat search: the typing only counts the repeats of the counted loci of the scheme (VNTR63_01) within the
+# max_product_size of their forward primer hits, so after the primer search only windows around those hits are searched
+# for repeats, instead of every whole contig.
+# The windows are only searched for the repeat units of the counted loci, the hits to other units would not be used.
+# The hits are moved back to contig coordinates, only their E-values differ from a whole contig search (shorter query).
+
+PAD = 200 # Extra bp on both sides, so repeats starting at the edge of the range are found whole, longer than every repeat unit
+WINDOW_TAG = '__mlvawindow' # qseqid of a window: contig + WINDOW_TAG + 0-based start of the window in the contig
+
+def repeat_windows(primer_rows, lengths, scheme): # {contig: [(start, end)]} 0-based half open, overlapping windows merged
+    forward = {scheme.primers[counted.forward]: counted.forward_min_bitscore for counted in scheme.counted.values()} # Cutoffs get_number_repeats uses
+    window = scheme.max_product_size + PAD
+    windows = {}
+    for row in primer_rows:
+        if row[1] not in forward or float(row[11]) < forward[row[1]] or row[0] not in lengths:
+            continue
+        qstart, qend = int(row[6]), int(row[7])
+        windows.setdefault(row[0], []).append((max(0, qend - window), min(lengths[row[0]], qstart + window)))
+    merged = {}
+    for contig, spans in windows.items():
+        for start, end in sorted(spans):
+            if contig in merged and start <= merged[contig][-1][1]:
+                merged[contig][-1] = (merged[contig][-1][0], max(end, merged[contig][-1][1]))
+            else:
+                merged.setdefault(contig, []).append((start, end))
+    return merged
+
+def write_counted_repeats(scheme, pth): # Subject of the second pass
+    counted = {scheme.repeats[counted.repeat] for counted in scheme.counted.values()}
+    with open(pth, 'w') as f:
+        for name, seq in read_records(scheme.repeat_file):
+            if name in counted:
+                f.write(f">{name}\n{seq}\n")
+
+def window_records(records, windows):
+    return [(f"{name}{WINDOW_TAG}{start}", seq[start:end]) for name, seq in records for start, end in windows.get(name, [])]
+
+def remap_rows(rows): # Window hits back to contig names and coordinates
+    for row in rows:
+        contig, start = row[0].rsplit(WINDOW_TAG, 1)
+        yield [contig] + row[1:6] + [str(int(row[6]) + int(start)), str(int(row[7]) + int(start))] + row[8:]
+
+def parse_arguments():
+    arg = argparse.ArgumentParser(description="Primer search of one assembly, then the repeat search in windows around the forward primer hits of the counted loci")
+    arg.add_argument("-engine", choices=['blastn', 'native'], default='blastn')
+    arg.add_argument("-query", required=True)
+    arg.add_argument("-scheme", default=DEFAULT_SCHEME)
+    arg.add_argument("-primer_out", required=True)
+    arg.add_argument("-repeat_out", required=True)
+    arg.add_argument("-perc_identity", type=int, default=50)
+    arg.add_argument("-num_threads", type=int, default=1)
+    return arg.parse_args()
+
+def main(): # Runs both passes as one job, so it works with every executor
+    from blast_mrsa_mlva import search_command
+    flags = parse_arguments()
+    scheme = load_scheme(flags.scheme)
+    subprocess.run(search_command(flags.engine, flags.query, scheme.primer_file, flags.primer_out, flags.perc_identity, flags.num_threads), check=True)
+    records = read_records(flags.query)
+    with open(flags.primer_out) as f:
+        windows = window_records(records, repeat_windows(csv.reader(f), {name: len(seq) for name, seq in records}, scheme))
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(flags.repeat_out))) as tmpdir:
+        rows = []
+        if len(windows) > 0: # Without a forward primer hit there is nothing to search
+            with open(f"{tmpdir}/windows.fasta", 'w') as f:
+                for name, seq in windows:
+                    f.write(f">{name}\n{seq}\n")
+            write_counted_repeats(scheme, f"{tmpdir}/counted_repeats.fasta")
+            subprocess.run(search_command(flags.engine, f"{tmpdir}/windows.fasta", f"{tmpdir}/counted_repeats.fasta", f"{tmpdir}/windows.csv", flags.perc_identity, flags.num_threads), check=True)
+            with open(f"{tmpdir}/windows.csv") as f:
+                rows = list(remap_rows(list(csv.reader(f))))
+    with open(flags.repeat_out, 'w') as f:
+        csv.writer(f, lineterminator='\n').writerows(rows)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except subprocess.CalledProcessError as e:
+        sys.exit(e.returncode)
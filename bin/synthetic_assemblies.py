@@ -0,0 +1,251 @@
+import argparse, os, textwrap
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from termcolor import colored
+import native_search
+from filter_mlva_blast import getmylogo, format_profile
+from mlva_scheme import load_scheme, DEFAULT_SCHEME, NO_BIN
+
+# Synthetic S. aureus-like assemblies with a known MLVA profile: an AT rich random background with the primer pairs of every
+# locus around tandem copies of its repeat unit, sized to fall in a bin of the scheme. The same scheme (primers, bins and
+# repeats) the typing uses, so the profile written in truth.tsv is what the pipeline should find. A random background has many more
+# short chance hits of the AT rich primers than a real genome of the same size, search times are on the high side.
+
+SPACING = 2000 # bp of background between two inserted loci, more than the max_product_size of the scheme so no primers of different inserts pair up
+FLANK = 10 # bp of random sequence at least between a primer and the repeats
+GC_CONTENT = 0.33
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+def parse_arguments(logo):
+    arg = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent(f"""
+        {colored(logo, 'red', attrs=["bold"])}
+        {colored('In silico MLVA typing for MRSA:', 'white', attrs=["bold", "underline"])}
+
+        Writes synthetic assemblies with known MLVA profiles and their ground truth (truth.tsv).
+-----------------------------------------------------------------------------------
+        {colored('Example usage:', 'green', attrs=["bold", "underline"])}
+            python {os.path.abspath(__file__)}
+            --output synthetic/
+            --isolates 100)
+-----------------------------------------------------------------------------------
+        """))
+    arg.add_argument("-o",
+                    "--output",
+                    metavar="Path",
+                    help="Output directory, the assemblies are written to fasta/ in here",
+                    type=str,
+                    required=True)
+    arg.add_argument("-n",
+                    "--isolates",
+                    metavar="INT",
+                    help="Number of assemblies (default: 10)",
+                    type=int,
+                    default=10,
+                    required=False)
+    add_generator_arguments(arg)
+    return arg.parse_args()
+
+def add_generator_arguments(arg): # Shared with benchmark_mlva.py
+    arg.add_argument("--scheme",
+                    metavar="Path",
+                    help="JSON definition of the MLVA scheme the assemblies are built for (default: files/mrsa_scheme.json)",
+                    type=str,
+                    default=DEFAULT_SCHEME,
+                    required=False)
+    arg.add_argument("--genome_size",
+                    metavar="INT",
+                    help="Length of every assembly in bp (default: 2800000)",
+                    type=int,
+                    default=2800000,
+                    required=False)
+    arg.add_argument("--contigs",
+                    metavar="INT",
+                    help="Number of contigs before fragmentation (default: 50)",
+                    type=int,
+                    default=50,
+                    required=False)
+    arg.add_argument("--fragmentation",
+                    metavar="FLOAT",
+                    help="Chance that a contig break falls between the forward primer and the rest of a locus (default: 0.05)",
+                    type=float,
+                    default=0.05,
+                    required=False)
+    arg.add_argument("--missing",
+                    metavar="FLOAT",
+                    help="Chance that a locus is left out of an assembly (default: 0.05)",
+                    type=float,
+                    default=0.05,
+                    required=False)
+    arg.add_argument("--mutations",
+                    metavar="FLOAT",
+                    help="Substitution rate in the background sequence (default: 0.01)",
+                    type=float,
+                    default=0.01,
+                    required=False)
+    arg.add_argument("--decoys",
+                    metavar="INT",
+                    help="Number of single primers without a partner inserted in every assembly (default: 5)",
+                    type=int,
+                    default=5,
+                    required=False)
+    arg.add_argument("--seed",
+                    metavar="INT",
+                    help="Random seed (default: 1)",
+                    type=int,
+                    default=1,
+                    required=False)
+
+class Scheme(object):
+    # Primer and repeat sequences and bins of a compiled MLVA scheme (mlva_scheme.py) the assemblies are built from
+    def __init__(self, mlva):
+        self.primers = dict(native_search.read_fasta(mlva.primer_file))
+        repeats = native_search.read_fasta(mlva.repeat_file)
+        self.units = {}
+        for locus in mlva.profile_loci: # The longest repeat name the locus starts with, VNTR61_01 is called VNTR61_0
+            names = [name for name, seq in repeats if locus.startswith(name)]
+            if locus in mlva.counted:
+                self.units[locus] = dict(repeats)[mlva.repeats[mlva.counted[locus].repeat]]
+            elif len(names) > 0:
+                self.units[locus] = dict(repeats)[max(names, key=len)]
+        mappings = pd.read_csv(mlva.bin_file, sep=",")
+        self.bins = {vntr: list(zip(group['Start'], group['Stop'], group['Value'])) for vntr, group in mappings.groupby('VNTR')}
+        self.pairs = {locus: (fname, rname) for locus, fname, rname, min_bitscore in mlva.pairs}
+        self.profile_loci, self.counted, self.markers = mlva.profile_loci, set(mlva.counted), mlva.markers
+        self.counted_primers = {mlva.primers[primer] for counted in mlva.counted.values() for primer in (counted.forward, counted.reverse)}
+
+def marker_statuses(marker): # Status of every value of a marker, 0 when its product is absent
+    statuses = {0: marker.absent}
+    statuses.update(marker.values)
+    return statuses
+
+def reverse_complement(seq):
+    return seq[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+def random_sequence(rng, length):
+    at, gc = (1 - GC_CONTENT) / 2, GC_CONTENT / 2
+    return BASES[rng.choice(4, size=length, p=[at, gc, gc, at])].tobytes().decode()
+
+def amplicon(rng, scheme, locus, size, copies=None):
+    # Forward primer, repeats and reverse complement of the reverse primer, with the product size typing computes (qend_r - qstart_f)
+    forward, reverse = scheme.primers[scheme.pairs[locus][0]], reverse_complement(scheme.primers[scheme.pairs[locus][1]])
+    inner = size + 1 - len(forward) - len(reverse)
+    unit = scheme.units.get(locus, '')
+    if copies is None:
+        copies = max(0, (inner - 2 * FLANK) // len(unit)) if unit else 0
+    flank = inner - copies * len(unit)
+    if flank < 0:
+        raise ValueError(f"{copies} repeats of {locus} don't fit in a product of {size} bp")
+    left = rng.randint(0, flank + 1) if flank < 2 * FLANK else rng.randint(FLANK, flank - FLANK + 1)
+    return forward + random_sequence(rng, left) + unit * copies + random_sequence(rng, flank - left) + reverse
+
+def bin_size(rng, start, stop): # A whole bp size within the bin, bins can have fractional edges
+    return rng.randint(int(np.ceil(start)), int(np.floor(stop)) + 1)
+
+def make_loci(rng, scheme, missing, vntr63_no_reverse):
+    # (locus, sequence, length of the forward primer) of every inserted locus and the allele codes and statuses they should give
+    loci, truth = [], {}
+    for locus in scheme.profile_loci:
+        if rng.rand() < missing:
+            truth[locus] = NO_BIN
+            continue
+        bins = [b for b in scheme.bins[locus] if locus not in scheme.counted or b[2] > 0] # Without repeats a counted locus can't be typed
+        start, stop, value = bins[rng.randint(len(bins))]
+        copies = value if locus in scheme.counted else None # VNTR63_01 is typed by counting its repeats
+        seq = amplicon(rng, scheme, locus, bin_size(rng, start, stop), copies)
+        if locus in scheme.counted and rng.rand() < vntr63_no_reverse: # Like VNTR63_01 in about 30% of the real isolates
+            seq = seq[:-len(scheme.primers[scheme.pairs[locus][1]])]
+        loci.append((locus, seq, len(scheme.primers[scheme.pairs[locus][0]])))
+        truth[locus] = int(value)
+    for marker in scheme.markers: # MecA and PVL, inserted with their own primers, not those of MecA_LGA
+        locus = marker.marker
+        value = rng.randint(len(marker_statuses(marker)))
+        bins = {v: (start, stop) for start, stop, v in scheme.bins[locus]}
+        if value > 0 and value in bins:
+            loci.append((locus, amplicon(rng, scheme, locus, bin_size(rng, *bins[value])), len(scheme.primers[scheme.pairs[locus][0]])))
+        else:
+            value = 0
+        truth[locus] = value
+    return loci, truth
+
+def make_isolate(rng, scheme, name, genome_size=2800000, contigs=50, fragmentation=0.05, missing=0.05, mutations=0.01,
+                 decoys=5, vntr63_no_reverse=0.3):
+    loci, truth = make_loci(rng, scheme, missing, vntr63_no_reverse)
+    # A lone VNTR63_01 reverse primer next to a chance hit of the forward primer hides the real forward primer
+    # (get_number_repeats only uses contigs with both), so the primers of counted loci are no decoys
+    primer_names = sorted(name for name in scheme.primers if name not in scheme.counted_primers)
+    for d in range(decoys): # Lone primers, further than max_product_size from anything they could pair with
+        primer = primer_names[rng.randint(len(primer_names))]
+        loci.append(('decoy', scheme.primers[primer], 0))
+    order = rng.permutation(len(loci))
+    free = genome_size - sum(len(seq) for locus, seq, f in loci) - SPACING * (len(loci) + 1)
+    if free < 0:
+        raise ValueError(f"A genome of {genome_size} bp is too small for {len(loci)} loci")
+    background = SPACING + rng.multinomial(free, [1 / (len(loci) + 1)] * (len(loci) + 1))
+    parts, breaks, position = [], [], 0
+    for n, i in enumerate(order):
+        locus, seq, forward = loci[i]
+        parts.append(mutate(rng, random_sequence(rng, background[n]), mutations))
+        position += background[n]
+        reverse = rng.rand() < 0.5 # Inserted on either strand
+        if locus != 'decoy' and rng.rand() < fragmentation: # The forward primer ends up on another contig than the rest
+            breaks.append(position + (len(seq) - forward if reverse else forward))
+            truth[locus] = 0 if locus not in scheme.profile_loci else NO_BIN
+        parts.append(reverse_complement(seq) if reverse else seq)
+        position += len(seq)
+    parts.append(mutate(rng, random_sequence(rng, background[-1]), mutations))
+    genome = ''.join(parts)
+    for n in range(contigs - 1): # Contig ends fall in the background between the loci
+        chunk = rng.randint(len(order) + 1)
+        offset = sum(background[:chunk]) + sum(len(loci[i][1]) for i in order[:chunk])
+        breaks.append(offset + rng.randint(1, background[chunk]))
+    edges = [0] + sorted(set(breaks)) + [len(genome)]
+    records = [(f"{name}_contig{n + 1}", genome[a:b]) for n, (a, b) in enumerate(zip(edges[:-1], edges[1:])) if b > a]
+    return records, isolate_truth(scheme, name, truth)
+
+def mutate(rng, seq, rate):
+    if rate <= 0:
+        return seq
+    codes = np.frombuffer(seq.encode(), dtype=np.uint8).copy()
+    sites = np.flatnonzero(rng.rand(len(codes)) < rate)
+    shifted = (np.searchsorted(BASES, codes[sites]) + rng.randint(1, 4, size=len(sites))) % 4
+    codes[sites] = BASES[shifted]
+    return codes.tobytes().decode()
+
+def isolate_truth(scheme, name, truth):
+    row = dict(isolate=name, profile=format_profile([truth[locus] for locus in scheme.profile_loci]))
+    row.update({marker.column: marker_statuses(marker)[truth[marker.marker]] for marker in scheme.markers})
+    row.update({locus: truth[locus] for locus in scheme.profile_loci})
+    return row
+
+def generate_cohort(scheme, isolates, seed=1, **settings): # Yields (records, truth) per isolate, the same cohort for the same seed
+    rng = np.random.RandomState(seed)
+    for n in range(isolates):
+        yield make_isolate(rng, scheme, f"synthetic_{n + 1:05d}", **settings)
+
+def generator_settings(flags):
+    return dict(genome_size=flags.genome_size, contigs=flags.contigs, fragmentation=flags.fragmentation,
+                missing=flags.missing, mutations=flags.mutations, decoys=flags.decoys)
+
+def write_fasta(records, pth):
+    with open(pth, 'w') as f:
+        for name, seq in records:
+            f.write(f">{name}\n")
+            for i in range(0, len(seq), 80):
+                f.write(seq[i:i + 80] + '\n')
+
+def main():
+    current_file_path = os.path.abspath(__file__)
+    parent_dir_path = os.path.dirname(os.path.dirname(current_file_path))
+    flags = parse_arguments(getmylogo(os.path.join(parent_dir_path, "files", "logo.txt")))
+    Path(f"{flags.output}/fasta").mkdir(parents=True, exist_ok=True) # Only assemblies in the pipeline input directory
+    truth = []
+    for records, row in generate_cohort(Scheme(load_scheme(flags.scheme)), flags.isolates, flags.seed, **generator_settings(flags)):
+        write_fasta(records, f"{flags.output}/fasta/{row['isolate']}.fasta")
+        truth.append(row)
+    pd.DataFrame(truth).to_csv(f"{flags.output}/truth.tsv", sep='\t', index=False)
+    print(f"{flags.isolates} assemblies and truth.tsv written to {os.path.abspath(flags.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,14 @@ dataecho=$(date +%y%m%d"_"%H"h"%M"m"%S"s")
 DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" > /dev/null 2>&1 && pwd )"
 INPUT_CMD=""
 OUTPUT_CMD=""
+EXECUTOR="local"
+WORKERS_CMD=""
+THREADS=1
+WAIT_TIMEOUT=7200
+STREAM=false
+CACHE_CMD=""
+SCHEME_CMD=""
+MULTI_CMD=""
 PATH_MASTER_YAML=$(echo "${DIR}/env/blastn_mlva.yaml")
 MASTER_NAME=$(head -n 1 ${PATH_MASTER_YAML} | cut -f2 -d ' ')
 
@@ -24,6 +32,13 @@ function usage(){
 	printf "\t-v, --version				: Print the version and exit\n"
 	printf "\t-i, --input				: Input directory with all your fasta files\n"
 	printf "\t-o, --output			: Output directory, defaults to current dir + /output \n"
+	printf "\t-e, --executor			: Where to run blastn: local or lsf (a job per search), local_array or lsf_array (one job array), defaults to local\n"
+	printf "\t-w, --workers			: Maximum number of blastn jobs at the same time, defaults to cores / threads\n"
+	printf "\t-t, --threads			: Threads per blastn job, defaults to 1\n"
+	printf "\t-s, --stream			: Type every isolate straight from the blastn output, without intermediate csv files\n"
+	printf "\t-c, --cache				: Directory with results of earlier runs, unchanged isolates are not searched again\n"
+	printf "\t-m, --scheme			: JSON definition of the MLVA scheme, defaults to files/mrsa_scheme.json\n"
+	printf "\t-M, --multi_isolate		: The input is one fasta file with >isolate|contig headers\n"
 }
 
 if [ $# == 0 ]
@@ -52,6 +67,32 @@ do
         OUTPUT="$2";
         shift
         ;;    
+    -e|--executor) 
+        EXECUTOR="$2";
+        shift
+        ;;
+    -w|--workers) 
+        WORKERS_CMD="--workers $2";
+        shift
+        ;;
+    -t|--threads) 
+        THREADS="$2";
+        shift
+        ;;
+    -s|--stream) 
+        STREAM=true
+        ;;
+    -c|--cache) 
+        CACHE_CMD="--cache $(realpath $2)";
+        shift
+        ;;
+    -m|--scheme) 
+        SCHEME_CMD="--scheme $(realpath $2)";
+        shift
+        ;;
+    -M|--multi_isolate) 
+        MULTI_CMD="--multi_isolate"
+        ;;
     --) shift; break;;
     esac
     shift
@@ -114,6 +155,15 @@ fi
 
 set -ue # Turn bash strict mode on again
 
-python bin/blast_mrsa_mlva.py ${INPUT_CMD} ${OUTPUT_CMD}
-sleep 5 # Wait for cluster to actually write the files
-python bin/filter_mlva_blast.py ${INPUT_CMD} ${OUTPUT_CMD}
+if [ "${STREAM}" == true ]
+then
+    python bin/blast_mrsa_mlva.py ${INPUT_CMD} ${OUTPUT_CMD} --executor ${EXECUTOR} --threads ${THREADS} ${WORKERS_CMD} ${CACHE_CMD} ${SCHEME_CMD} ${MULTI_CMD} --stream
+else
+    # Typing starts on every isolate as soon as blast marks both of its outputs as done
+    rm -f "${OUTPUT_DIR}"/blastn/*.done "${OUTPUT_DIR}"/blastn/*.failed
+    python bin/blast_mrsa_mlva.py ${INPUT_CMD} ${OUTPUT_CMD} --executor ${EXECUTOR} --threads ${THREADS} ${WORKERS_CMD} ${CACHE_CMD} ${SCHEME_CMD} ${MULTI_CMD} &
+    BLAST_PID=$!
+    # Typing stops waiting as soon as blast exits, also when blast died before marking any isolate
+    python bin/filter_mlva_blast.py ${INPUT_CMD} ${OUTPUT_CMD} --wait ${WAIT_TIMEOUT} --blast_pid ${BLAST_PID} ${SCHEME_CMD} ${MULTI_CMD}
+    wait ${BLAST_PID}
+fi
@@ -0,0 +1,22 @@
+import os, sys
+import pytest
+
+# The scripts in bin/ import each other as top level modules, the tests do the same
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin")
+sys.path.insert(0, BIN)
+
+from mlva_scheme import load_scheme
+from synthetic_assemblies import Scheme, generate_cohort, write_fasta
+
+@pytest.fixture(scope="session")
+def scheme():
+    return load_scheme()
+
+@pytest.fixture(scope="session")
+def cohort(tmp_path_factory, scheme): # Three small synthetic assemblies and their ground truth
+    fasta = tmp_path_factory.mktemp("fasta")
+    isolates = []
+    for records, truth in generate_cohort(Scheme(scheme), 3, seed=7, genome_size=60000, contigs=5):
+        write_fasta(records, str(fasta / f"{truth['isolate']}.fasta"))
+        isolates.append((str(fasta / f"{truth['isolate']}.fasta"), truth))
+    return isolates
@@ -0,0 +1,36 @@
+import os, subprocess, sys
+import pytest
+import native_search
+from conftest import BIN
+from blast_mrsa_mlva import split_batch_hits, write_batch_query, write_batch_subject
+
+def lines(pth):
+    with open(pth) as f:
+        return sorted(f)
+
+def test_batch_hits_split_into_per_isolate_files(tmp_path, scheme, cohort):
+    # One search of all isolates against primers and repeats gives the hits of one search per isolate and file
+    isolates = [fasta for fasta, truth in cohort]
+    outputnames = [str(tmp_path / f"isolate{n}") for n in range(len(isolates))]
+    write_batch_query(isolates, str(tmp_path / "batch.fasta"))
+    write_batch_subject(scheme.primer_file, scheme.repeat_file, str(tmp_path / "subject.fasta"))
+    native_search.search_file(str(tmp_path / "batch.fasta"), str(tmp_path / "subject.fasta"), str(tmp_path / "batch.csv"), 50)
+    split_batch_hits(str(tmp_path / "batch.csv"), outputnames, set(scheme.primers))
+    for fasta, outputname in zip(isolates, outputnames):
+        native_search.search_file(fasta, scheme.primer_file, str(tmp_path / "primers.csv"), 50)
+        native_search.search_file(fasta, scheme.repeat_file, str(tmp_path / "repeat.csv"), 50)
+        assert lines(f"{outputname}_primers-blastn.csv") == lines(tmp_path / "primers.csv") != []
+        assert lines(f"{outputname}_repeat-blastn.csv") == lines(tmp_path / "repeat.csv") != []
+
+def test_isolate_without_hits_gets_empty_files(tmp_path):
+    with open(tmp_path / "batch.csv", "w") as f:
+        f.write("mlva1__contig_1,VNTR09_01_F,100.000,20,0,0,1,20,1,20,1.2e-05,40.1\n")
+    split_batch_hits(str(tmp_path / "batch.csv"), [str(tmp_path / "A"), str(tmp_path / "B")], {"VNTR09_01_F"})
+    assert lines(tmp_path / "A_primers-blastn.csv") == lines(tmp_path / "A_repeat-blastn.csv") == []
+    assert lines(tmp_path / "B_primers-blastn.csv") == ["contig_1,VNTR09_01_F,100.000,20,0,0,1,20,1,20,1.2e-05,40.1\n"]
+
+@pytest.mark.parametrize("conflict", [["--batch_size", "2"], ["--executor", "lsf"]])
+def test_stream_rejects_batches_and_other_executors(tmp_path, conflict):
+    completed = subprocess.run([sys.executable, os.path.join(BIN, "blast_mrsa_mlva.py"), "-i", str(tmp_path), "-o", str(tmp_path / "out"), "--stream"] + conflict,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    assert completed.returncode == 2 and "--stream" in completed.stderr
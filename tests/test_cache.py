@@ -0,0 +1,46 @@
+import os, shutil, subprocess, sys
+import pytest
+from conftest import BIN
+from mlva_cache import ResultCache
+
+def read_manifest(pth):
+    with open(pth) as f:
+        next(f)
+        return sorted(tuple(line.split('\t')[::2]) for line in f) # isolate and status
+
+def test_key_follows_files_and_settings(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    (tmp_path / "a.fasta").write_text(">a\nACGT\n")
+    key = cache.key([str(tmp_path / "a.fasta")], perc_identity=50, engine='blastn')
+    assert key == ResultCache(str(tmp_path / "cache")).key([str(tmp_path / "a.fasta")], engine='blastn', perc_identity=50)
+    assert key != cache.key([str(tmp_path / "a.fasta")], perc_identity=60, engine='blastn')
+    (tmp_path / "a.fasta").write_text(">a\nACGA\n")
+    assert key != ResultCache(str(tmp_path / "cache")).key([str(tmp_path / "a.fasta")], perc_identity=50, engine='blastn')
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    (tmp_path / "hits.csv").write_text("contig_1,VNTR09_01_F\n")
+    assert not cache.get("ab12", {"hits.csv": str(tmp_path / "copy.csv")})
+    cache.put("ab12", {"hits.csv": str(tmp_path / "hits.csv")})
+    assert cache.get("ab12", {"hits.csv": str(tmp_path / "copy.csv")})
+    assert (tmp_path / "copy.csv").read_text() == "contig_1,VNTR09_01_F\n"
+    cache.put_rows("cd34", [{"isolate": "A", "profile": "1-2"}], {})
+    assert cache.get_rows("cd34") == [{"isolate": "A", "profile": "1-2"}]
+    assert cache.get_rows("ef56") is None
+
+@pytest.mark.parametrize("mode", [[], ["--stream"]])
+def test_unchanged_isolates_are_reused(tmp_path, cohort, mode):
+    fasta = tmp_path / "fasta"
+    fasta.mkdir()
+    for pth, truth in cohort:
+        shutil.copy(pth, fasta)
+    names = sorted(truth['isolate'] for pth, truth in cohort)
+    def run(output):
+        subprocess.run([sys.executable, os.path.join(BIN, "blast_mrsa_mlva.py"), "-i", str(fasta), "-o", str(tmp_path / output),
+                        "-s", "native", "--cache", str(tmp_path / "cache")] + mode, check=True, stdout=subprocess.DEVNULL)
+        return read_manifest(tmp_path / output / "blastn" / "cache_manifest.tsv")
+    assert run("first") == [(name, 'computed') for name in names]
+    with open(fasta / f"{names[0]}.fasta", 'a') as f: # A changed assembly is searched again
+        f.write(">extra\nACGTACGTACGT\n")
+    reused = 'profile reused' if mode else 'hits reused'
+    assert run("second") == [(names[0], 'computed')] + [(name, reused) for name in names[1:]]
@@ -0,0 +1,72 @@
+import json, os, stat
+import pytest
+from mlva_executors import ArrayExecutor, LocalArrayExecutor, LsfArrayExecutor, task_marker
+
+def fake_command(directory, name, script): # A stand-in for bsub or bjobs on the PATH
+    pth = directory / name
+    pth.write_text(f"#!/bin/sh\n{script}\n")
+    pth.chmod(pth.stat().st_mode | stat.S_IEXEC)
+
+@pytest.fixture
+def fake_lsf(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', f"{tmp_path / 'lsf'}{os.pathsep}{os.environ['PATH']}")
+    (tmp_path / 'lsf').mkdir()
+    return tmp_path / 'lsf'
+
+def completed(executor):
+    executor.flush()
+    results = dict(executor.as_completed())
+    executor.shutdown()
+    return results
+
+def test_array_executor_is_abstract():
+    with pytest.raises(TypeError):
+        ArrayExecutor()
+
+def test_local_array_reports_every_group(tmp_path):
+    executor = LocalArrayExecutor(workers=2, isolates_per_task=2, workdir=str(tmp_path / "array"))
+    executor.submit('ok', ['true'])
+    executor.submit('ok', ['true'])
+    executor.submit('failed', ['true'])
+    executor.submit('failed', ['false'])
+    executor.submit('missing', ['no-such-command-mlva'])
+    assert completed(executor) == {'ok': True, 'failed': False, 'missing': False}
+    with open(task_marker(str(tmp_path / "array"), 1)) as f:
+        assert json.load(f) == {'ok': True, 'failed': False}
+
+def test_task_without_marker_fails_its_groups(tmp_path):
+    class CrashingTasks(LocalArrayExecutor): # Every task dies before it writes its marker
+        def launch(self, cmd, tasks, resources):
+            super().launch(['sh', '-c', 'exit 3'], tasks, resources)
+    executor = CrashingTasks(isolates_per_task=1, workdir=str(tmp_path / "array"))
+    executor.poll = 0.01
+    executor.submit('a', ['true'])
+    executor.submit('b', ['true'])
+    assert completed(executor) == {'a': False, 'b': False}
+
+def test_failed_submission_fails_every_task(tmp_path, fake_lsf):
+    fake_command(fake_lsf, 'bsub', 'echo "cluster down" >&2; exit 255')
+    executor = LsfArrayExecutor(isolates_per_task=1, workdir=str(tmp_path / "array"))
+    executor.submit('a', ['true'])
+    executor.submit('b', ['true'])
+    assert completed(executor) == {'a': False, 'b': False}
+    assert os.path.exists(task_marker(str(tmp_path / "array"), 2))
+
+def test_job_unknown_to_lsf_fails(tmp_path, fake_lsf):
+    fake_command(fake_lsf, 'bsub', 'echo "Job <123> is submitted to queue <bio>."')
+    fake_command(fake_lsf, 'bjobs', 'echo "Job <123> is not found" >&2; exit 255')
+    executor = LsfArrayExecutor(isolates_per_task=1, workdir=str(tmp_path / "array"))
+    executor.poll, executor.check_every = 0.01, 0
+    executor.submit('a', ['true'])
+    assert completed(executor) == {'a': False}
+
+def test_tasks_fail_after_the_timeout(tmp_path, fake_lsf):
+    fake_command(fake_lsf, 'bsub', 'echo "Job <123> is submitted to queue <bio>."')
+    fake_command(fake_lsf, 'bjobs', 'echo "1 RUN"; echo "2 PEND"')
+    fake_command(fake_lsf, 'bkill', f'echo "$@" > {fake_lsf}/killed')
+    executor = LsfArrayExecutor(isolates_per_task=1, workdir=str(tmp_path / "array"), timeout=0.1)
+    executor.poll, executor.check_every = 0.01, 0
+    executor.submit('a', ['true'])
+    executor.submit('b', ['true'])
+    assert completed(executor) == {'a': False, 'b': False}
+    assert (fake_lsf / 'killed').read_text() == "123[1,2]\n"
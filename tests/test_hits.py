@@ -0,0 +1,26 @@
+import os, shutil, subprocess, sys
+import pytest
+import native_search
+from conftest import BIN
+from mlva_hits import find_hits, hit_path, read_hits
+
+def test_hits_of_several_formats_are_not_guessed(tmp_path):
+    for hit_format in ('csv', 'npz'):
+        (tmp_path / os.path.basename(hit_path(str(tmp_path / "A"), 'primers', hit_format))).write_text("")
+    with pytest.raises(ValueError):
+        find_hits(str(tmp_path / "A"), 'primers')
+
+def test_rerun_in_another_format_types_the_new_hits(tmp_path, scheme, cohort):
+    (tmp_path / "fasta").mkdir()
+    assembly = str(tmp_path / "fasta" / "isolate.fasta")
+    def run(source, hit_format):
+        shutil.copy(source, assembly)
+        subprocess.run([sys.executable, os.path.join(BIN, "blast_mrsa_mlva.py"), "-i", str(tmp_path / "fasta"), "-o", str(tmp_path / "out"),
+                        "-s", "native", "--hit_format", hit_format], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    run(cohort[0][0], 'npz')
+    run(cohort[1][0], 'csv') # Another assembly under the same name
+    outputname = str(tmp_path / "out" / "blastn" / "isolate")
+    assert find_hits(outputname, 'primers') == hit_path(outputname, 'primers', 'csv')
+    assert not os.path.exists(hit_path(outputname, 'primers', 'npz'))
+    native_search.search_file(cohort[1][0], scheme.primer_file, str(tmp_path / "primers.csv"), 50)
+    assert len(read_hits(find_hits(outputname, 'primers'))) == len(read_hits(str(tmp_path / "primers.csv")))
@@ -0,0 +1,86 @@
+import gzip, os, shutil, stat, subprocess, sys
+import pytest
+import native_search
+from blast_mrsa_mlva import search_command
+from compare_search_engines import compare_hits, hit_frame
+from filter_mlva_blast import type_hits
+from mlva_hits import read_hits
+from mlva_input import discover_inputs, query_pipe, read_records, is_fasta, write_records
+
+MIN_BITSCORE = 15 # The lowest typing cutoff, as in compare_search_engines.py
+
+@pytest.fixture
+def compressed(tmp_path, cohort):
+    fasta, truth = cohort[0]
+    with open(fasta, 'rb') as f, gzip.open(tmp_path / "isolate.fasta.gz", 'wb') as out:
+        shutil.copyfileobj(f, out)
+    return fasta, str(tmp_path / "isolate.fasta.gz")
+
+def test_piped_query_gives_the_same_hits(tmp_path, scheme, compressed):
+    fasta, gz = compressed
+    native = [sys.executable, native_search.__file__, '-query', '-', '-subject', scheme.primer_file, '-out', str(tmp_path / "piped.csv"), '-perc_identity', '50']
+    subprocess.run(query_pipe(gz, native), check=True)
+    native_search.search_file(fasta, scheme.primer_file, str(tmp_path / "plain.csv"), 50)
+    assert (tmp_path / "piped.csv").read_text() == (tmp_path / "plain.csv").read_text() != ""
+
+def test_broken_compressed_query_fails_the_search(tmp_path, compressed):
+    fasta, gz = compressed
+    with open(gz, 'rb') as f:
+        data = f.read()
+    with open(tmp_path / "broken.fasta.gz", 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert subprocess.run(query_pipe(str(tmp_path / "broken.fasta.gz"), ['cat']), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0
+
+@pytest.mark.skipif(shutil.which('zstd') is None, reason="needs the zstd command")
+def test_zstd_pipe_checks_the_exit_status(tmp_path, cohort, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'zstandard', None) # The fallback on the zstd command
+    fasta, truth = cohort[0]
+    subprocess.run(['zstd', '-q', fasta, '-o', str(tmp_path / "isolate.fasta.zst")], check=True)
+    assert read_records(str(tmp_path / "isolate.fasta.zst")) == read_records(fasta)
+    assert is_fasta(str(tmp_path / "isolate.fasta.zst"))
+    with open(tmp_path / "isolate.fasta.zst", 'rb') as f:
+        data = f.read()
+    with open(tmp_path / "broken.fasta.zst", 'wb') as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(OSError):
+        read_records(str(tmp_path / "broken.fasta.zst"))
+
+def test_written_records_are_readable_by_others(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        write_records([('contig_1', 'ACGT')], str(tmp_path / "isolate.fasta.gz"))
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(tmp_path / "isolate.fasta.gz").st_mode) == 0o644
+
+@pytest.mark.skipif(shutil.which('blastn') is None, reason="needs blastn")
+def test_native_search_agrees_with_blastn(tmp_path, scheme, compressed):
+    # blastn gets the compressed query through a pipe, the native search reads it directly
+    fasta, gz = compressed
+    hits = {}
+    for search, subject in (('primers', scheme.primer_file), ('repeat', scheme.repeat_file)):
+        for engine in ('blastn', 'native'):
+            subprocess.run(search_command(engine, gz, subject, str(tmp_path / f"{engine}_{search}.csv"), 50, 1), check=True)
+            hits[engine, search] = read_hits(str(tmp_path / f"{engine}_{search}.csv"))
+        shared, blast_only, native_only, max_diff = compare_hits(hit_frame(hits['blastn', search], MIN_BITSCORE), hit_frame(hits['native', search], MIN_BITSCORE))
+        assert shared > 0 and blast_only == native_only == 0
+    profiles = [sorted(type_hits(hits[engine, 'primers'], hits[engine, 'repeat'], scheme)[0]) for engine in ('blastn', 'native')]
+    assert profiles[0] == profiles[1]
+
+def test_fasta_is_one_isolate_unless_asked_for(tmp_path):
+    (tmp_path / "single.fasta").write_text(">gnl|contig_1\nACGT\n>gnl|contig_2\nACGT\n")
+    assert discover_inputs(str(tmp_path / "single.fasta"), str(tmp_path / "split")) == [str(tmp_path / "single.fasta")]
+    assert not os.path.exists(tmp_path / "split")
+
+def test_multi_isolate_fasta_is_split(tmp_path):
+    (tmp_path / "cohort.fasta").write_text(">A|c1\nACGT\n>B|c1\nGGCC\n>A|c2\nTTAA\n")
+    split = discover_inputs(str(tmp_path / "cohort.fasta"), str(tmp_path / "split"), multi_isolate=True)
+    assert [os.path.basename(pth) for pth in split] == ["A.fasta.gz", "B.fasta.gz"]
+    assert read_records(split[0]) == [('c1', 'ACGT'), ('c2', 'TTAA')]
+    assert discover_inputs(str(tmp_path / "cohort.fasta"), str(tmp_path / "split"), write=False, multi_isolate=True) == split
+
+def test_headers_without_isolate_are_not_dropped(tmp_path):
+    (tmp_path / "mixed.fasta").write_text(">A|c1\nACGT\n>c2_no_isolate\nACGT\n>B|c1\nACGT\n")
+    for write in (True, False):
+        with pytest.raises(SystemExit, match="c2_no_isolate"):
+            discover_inputs(str(tmp_path / "mixed.fasta"), str(tmp_path / "split"), write=write, multi_isolate=True)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from mlva_profiles import ProfileStore, decode_profile, encode_profile
+from mlva_scheme import NO_BIN
+
+LOCI = ['A', 'B', 'C', 'D']
+
+def distance(p, q): # Loci with a different code, a missing locus (99) doesn't count
+    return sum(a != b and NO_BIN not in (a, b) for a, b in zip(p, q))
+
+def random_store(n, seed=3):
+    rng = np.random.RandomState(seed)
+    store = ProfileStore(LOCI)
+    profiles = []
+    for i in range(n):
+        profile = [int(c) for c in rng.choice([1, 2, 3, NO_BIN], size=len(LOCI), p=[0.4, 0.3, 0.2, 0.1])]
+        store.add(f"isolate{i}", decode_profile(profile))
+        profiles.append(profile)
+    return store, profiles
+
+def test_profiles_round_trip():
+    assert decode_profile(encode_profile("14-00-99-04", LOCI)) == "14-00-99-04"
+    with pytest.raises(ValueError):
+        encode_profile("14-00-99", LOCI)
+
+def test_distances_match_a_pairwise_count():
+    store, profiles = random_store(1030) # More isolates than the first allocation
+    expected = np.array([[distance(p, q) for q in profiles] for p in profiles])
+    blocks = list(store.distance_blocks(block_bytes=4 * len(store) * 100)) # A hundred rows per block
+    assert len(blocks) == 11
+    assert (np.concatenate([d for start, d in blocks]) == expected).all()
+
+def test_nearest_is_closest_first():
+    store = ProfileStore(LOCI)
+    for name, profile in [('a', '01-01-01-01'), ('b', '01-02-02-02'), ('c', '01-01-99-02'), ('d', '01-01-01-01')]:
+        store.add(name, profile)
+    store.add('b', '02-02-02-02') # Stored again with its new profile
+    assert [(name, d) for name, d, profile in store.nearest('01-01-01-02', k=4)] == [('c', 0), ('a', 1), ('d', 1), ('b', 3)]
+    assert store.nearest('01-01-01-02', k=1)[0][2] == '01-01-99-02'
+
+def test_clusters_are_single_linkage():
+    store, profiles = random_store(300)
+    for max_distance in (0, 1, 2):
+        labels = store.clusters(max_distance)
+        # Reference: connected components of the graph of profiles within max_distance
+        expected, n = [0] * len(profiles), 0
+        for start in range(len(profiles)):
+            if expected[start] == 0:
+                n += 1
+                expected[start], todo = n, [start]
+                while todo:
+                    i = todo.pop()
+                    for j in range(len(profiles)):
+                        if expected[j] == 0 and distance(profiles[i], profiles[j]) <= max_distance:
+                            expected[j] = n
+                            todo.append(j)
+        assert labels.tolist() == expected
+
+def test_saved_store_loads_the_same(tmp_path):
+    store, profiles = random_store(20)
+    store.save(str(tmp_path / "profiles.npz"))
+    loaded = ProfileStore.load(str(tmp_path / "profiles.npz"), LOCI)
+    assert loaded.names == store.names and (loaded.codes == store.codes).all()
+    with pytest.raises(ValueError):
+        ProfileStore.load(str(tmp_path / "profiles.npz"), LOCI[::-1])
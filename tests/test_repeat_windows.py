@@ -0,0 +1,16 @@
+import os, subprocess, sys
+import native_search
+from conftest import BIN
+from filter_mlva_blast import type_hits
+from mlva_hits import read_hits
+
+def test_two_pass_only_keeps_counted_repeats(tmp_path, scheme, cohort):
+    fasta, truth = cohort[0]
+    subprocess.run([sys.executable, os.path.join(BIN, "repeat_windows.py"), "-engine", "native", "-query", fasta,
+                    "-primer_out", str(tmp_path / "primers.csv"), "-repeat_out", str(tmp_path / "repeat.csv")], check=True)
+    native_search.search_file(fasta, scheme.repeat_file, str(tmp_path / "all_repeats.csv"), 50)
+    two_pass, whole = read_hits(str(tmp_path / "repeat.csv")), read_hits(str(tmp_path / "all_repeats.csv"))
+    assert 0 < len(two_pass) < len(whole)
+    assert set(two_pass['sseqid']) == {scheme.repeats[counted.repeat] for counted in scheme.counted.values()}
+    primers = read_hits(str(tmp_path / "primers.csv"))
+    assert type_hits(primers, two_pass, scheme)[0] == type_hits(primers, whole, scheme)[0]
@@ -0,0 +1,35 @@
+import os, shutil
+import numpy as np
+import pandas as pd
+import mlva_scheme
+from mlva_scheme import BinIndex, NO_BIN, load_scheme
+
+def linear_bin(starts, stops, values, size, nearest=False): # The row by row lookup BinIndex replaced, on the rows of one VNTR
+    matching = [value for start, stop, value in zip(starts, stops, values) if start <= size <= stop]
+    if len(matching) == 1:
+        return int(matching[0])
+    if not nearest or len(values) == 0:
+        return NO_BIN
+    return int(values[np.argmin(np.abs(starts - size) + np.abs(stops - size))])
+
+def test_bin_index_matches_the_linear_lookup(scheme):
+    df_mappings = pd.read_csv(scheme.bin_file, sep=",")
+    index = BinIndex(df_mappings)
+    for vntr in list(df_mappings['VNTR'].unique()) + ['not_a_locus']:
+        rows = df_mappings.loc[df_mappings['VNTR'] == vntr] # In the order of the file, like the old lookup
+        sizes = np.arange(rows['Start'].min() - 50, rows['Stop'].max() + 50, 0.25) if len(rows) > 0 else np.arange(0, 100)
+        for nearest in (False, True):
+            expected = [linear_bin(rows['Start'].values, rows['Stop'].values, rows['Value'].values, size, nearest) for size in sizes]
+            assert index.lookup(vntr, sizes, nearest).tolist() == expected
+
+def test_compiled_scheme_is_kept_per_checkout(tmp_path, monkeypatch):
+    # Two checkouts with the same scheme files share the cache, but each gets the paths of its own files
+    files = os.path.dirname(mlva_scheme.DEFAULT_SCHEME)
+    for checkout in ('a', 'b'):
+        shutil.copytree(files, tmp_path / checkout)
+    for checkout in ('a', 'b', 'a'):
+        monkeypatch.setattr(mlva_scheme, '_SCHEMES', {}) # A new process
+        scheme = load_scheme(str(tmp_path / checkout / "mrsa_scheme.json"), str(tmp_path / "cache"))
+        assert scheme.primer_file == str(tmp_path / checkout / "mrsa_mlva_primers.fasta")
+    assert len(os.listdir(tmp_path / "cache")) == 2
+    assert scheme.digest == load_scheme(str(tmp_path / "b" / "mrsa_scheme.json")).digest
@@ -0,0 +1,35 @@
+import subprocess, time
+from filter_mlva_blast import wait_for_blast
+from mlva_executors import write_marker
+
+def test_markers_are_yielded(tmp_path):
+    files = [str(tmp_path / "A.fasta"), str(tmp_path / "B.fasta")]
+    write_marker(str(tmp_path / "A"), True)
+    write_marker(str(tmp_path / "B"), False)
+    missing = []
+    assert list(wait_for_blast(files, str(tmp_path), 60, missing=missing)) == [files[0]]
+    assert missing == []
+
+def test_stops_when_blast_exits(tmp_path):
+    blast = subprocess.Popen(["true"])
+    blast.wait()
+    files = [str(tmp_path / "A.fasta")]
+    missing = []
+    start = time.time()
+    assert list(wait_for_blast(files, str(tmp_path), 7200, blast_pid=blast.pid, missing=missing)) == []
+    assert missing == files
+    assert time.time() - start < 5
+
+def test_stops_at_the_timeout(tmp_path):
+    files = [str(tmp_path / "A.fasta")]
+    missing = []
+    assert list(wait_for_blast(files, str(tmp_path), 0, missing=missing)) == []
+    assert missing == files
+
+def test_exited_but_not_reaped_blast_has_stopped(tmp_path):
+    blast = subprocess.Popen(["true"])
+    time.sleep(0.5) # Not waited for, so it stays a zombie
+    missing = []
+    assert list(wait_for_blast([str(tmp_path / "A.fasta")], str(tmp_path), 7200, blast_pid=blast.pid, missing=missing)) == []
+    assert len(missing) == 1
+    blast.wait()